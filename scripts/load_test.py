@@ -0,0 +1,334 @@
+import argparse
+import asyncio
+import contextlib
+import ipaddress
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+controller_dir = os.path.join(parent_dir, "service_controller", "src")
+sys.path.append(parent_dir)
+sys.path.append(controller_dir)
+
+import requests
+import setup_adf
+
+# Stand-ins for teams/challenges/*, service name -> (port, /health response)
+CHALLENGES = {
+    "python_challenge": (5000, "Python Challenge is running!"),
+    "node_challenge": (3000, "Node.js Challenge is running!"),
+}
+
+
+# Loopback address of a team, 127.0.1.1 for team 1. Linux routes all of 127.0.0.0/8 to lo
+def team_address(team):
+    return str(ipaddress.ip_address("127.0.1.0") + team)
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    pick = lambda p: round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 2)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+        "p50_ms": pick(50),
+        "p90_ms": pick(90),
+        "p99_ms": pick(99),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+# Lightweight team service answering /health and /flag like the real challenge containers
+class StandInService:
+    def __init__(self, team, service_name, args, planted):
+        port, health = CHALLENGES[service_name]
+        self.team = team
+        self.args = args
+        self.planted = planted
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                service.handle(self, health)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((team_address(team), port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def handle(self, request, health):
+        # Injected latency and failures
+        if self.args.latency or self.args.jitter:
+            time.sleep(max(0, random.gauss(self.args.latency, self.args.jitter)) / 1000)
+        if random.random() < self.args.hang_rate:
+            time.sleep(self.args.check_timeout * 2)
+        if random.random() < self.args.failure_rate:
+            body, code = "Injected failure", 500
+        else:
+            url = urlsplit(request.path)
+            if url.path == "/health":
+                body, code = health, 200
+            elif url.path == "/flag":
+                # Keep planted flags so simulated attackers have something to steal
+                for flag in parse_qs(url.query).get("flag", []):
+                    self.planted.append((self.team, flag))
+                body, code = "Flag submitted", 200
+            else:
+                body, code = "Not found", 404
+        data = body.encode()
+        request.send_response(code)
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Simulated attacking team submitting stolen and junk flags in a loop
+class Submitter(threading.Thread):
+    def __init__(self, team, url, args, planted, stop):
+        super().__init__(daemon=True)
+        self.team = team
+        self.url = url
+        self.args = args
+        self.planted = planted
+        self.stop_event = stop
+        self.seen = 0
+        self.latencies = []
+        self.flags = 0
+        self.accepted = 0
+        self.statuses = {}
+        self.errors = 0
+
+    def run(self):
+        session = requests.Session()
+        while not self.stop_event.is_set():
+            stolen = [flag for team, flag in self.planted[self.seen:] if team != self.team]
+            self.seen = len(self.planted)
+            junk = max(0, self.args.submit_batch - len(stolen)) if self.args.junk else 0
+            flags = stolen[:self.args.submit_batch] + ["flag{" + os.urandom(32).hex() + "}" for _ in range(junk)]
+            if not flags:
+                time.sleep(0.05)
+                continue
+
+            start = time.time()
+            try:
+                response = session.post(self.url, json={"team_id": self.team, "flags": flags}, timeout=10)
+            except requests.RequestException:
+                self.errors += 1
+                continue
+            self.latencies.append(time.time() - start)
+            self.flags += len(flags)
+            self.statuses[response.status_code] = self.statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                self.accepted += response.json().get("valid_flags", 0)
+            elif response.status_code == 429:
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    os.chdir(workdir)
+
+    teams = [f"team{i}" for i in range(1, args.teams + 1)]
+    services = [(name, CHALLENGES[name][0], args.check_timeout) for name in args.services]
+    setup_adf.initialize_database(teams, services)
+
+    # Checker plugins reach the stand-ins through the shared HTTP client's host overrides
+    os.environ.setdefault("CHECKER_DIR", os.path.join(controller_dir, "checkers"))
+    os.environ["CHECKER_HOSTS"] = ",".join(f"team{i}={team_address(i)}" for i in range(1, args.teams + 1))
+    os.environ["NUM_TEAMS"] = str(args.teams)
+    os.environ["TICK_INTERVAL"] = str(args.tick_interval)
+    os.environ["API_PORT"] = str(args.api_port)
+    if args.agents:
+        os.environ["EXECUTION_MODE"] = "agents"
+        os.environ["AGENT_PORT"] = str(args.agent_port)
+
+    from service_controller import ServiceController
+    import tracing
+
+    planted = []
+    standins = [StandInService(team, name, args, planted)
+                for team in range(args.down_teams + 1, args.teams + 1) for name in args.services]
+
+    controller = ServiceController()
+
+    # Time every checker call as seen by the tick engine's workers
+    check_latencies = {name: [] for name in args.services}
+    check_statuses = {}
+
+    def observe_check(service_name, start, status):
+        check_latencies[service_name].append(time.time() - start)
+        check_statuses[status] = check_statuses.get(status, 0) + 1
+
+    agents = []
+    if args.agents:
+        # Checks go through the controller's job server to local agent processes
+        run_agents = controller.agents.run
+
+        async def timed_dispatch(service_name, tick, team, flag, timeout=None):
+            start = time.time()
+            status = await run_agents(service_name, tick, team, flag, timeout)
+            observe_check(service_name, start, status)
+            return status
+
+        controller.agents.run = timed_dispatch
+        agent_env = dict(os.environ, CONTROLLER_URL=f"http://127.0.0.1:{args.agent_port}")
+        agents = [subprocess.Popen([sys.executable, "checker_agent.py"], cwd=controller_dir, env=agent_env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                  for _ in range(args.agents)]
+    else:
+        run_checker = controller.checkers.run
+
+        def timed_run(service_name, team, flag, timeout=None):
+            start = time.time()
+            status = run_checker(service_name, team, flag, timeout)
+            observe_check(service_name, start, status)
+            return status
+
+        controller.checkers.run = timed_run
+
+    api = f"http://127.0.0.1:{args.api_port}"
+    for _ in range(50):
+        try:
+            requests.get(api + "/", timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.1)
+
+    stop = threading.Event()
+    submitters = [Submitter(i % args.teams + 1, api + "/submit_flags", args, planted, stop)
+                  for i in range(args.submitters)]
+    for submitter in submitters:
+        submitter.start()
+
+    async def run_ticks():
+        timeouts = controller.db.get_service_timeouts()
+        ticks = []
+        tick_start = time.time()
+        for tick in range(1, args.ticks + 1):
+            deadline = tick_start + args.tick_interval
+            start = time.time()
+            check_seconds = await controller.run_tick(args.services, tick, timeouts, deadline)
+            ticks.append({
+                "tick": tick,
+                "check_seconds": round(check_seconds, 3),
+                "total_seconds": round(time.time() - start, 3),
+                "slack_seconds": round(deadline - time.time(), 3),
+            })
+            tick_start = max(deadline, time.time())
+            await asyncio.sleep(max(0, tick_start - time.time()))
+        return ticks
+
+    start = time.time()
+    ticks = asyncio.run(run_ticks())
+    elapsed = time.time() - start
+    stop.set()
+    for submitter in submitters:
+        submitter.join(timeout=15)
+    for standin in standins:
+        standin.stop()
+    controller.engine.shutdown()
+    tracing.tracer.flush()
+    for agent in agents:
+        agent.terminate()
+
+    submit_latencies = [latency for submitter in submitters for latency in submitter.latencies]
+    submitted = sum(submitter.flags for submitter in submitters)
+    statuses = {}
+    for submitter in submitters:
+        for status, count in submitter.statuses.items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+
+    tick_totals = [tick["total_seconds"] for tick in ticks]
+    return {
+        "config": {
+            "teams": args.teams,
+            "services": args.services,
+            "ticks": args.ticks,
+            "tick_interval": args.tick_interval,
+            "check_timeout": args.check_timeout,
+            "down_teams": args.down_teams,
+            "failure_rate": args.failure_rate,
+            "hang_rate": args.hang_rate,
+            "latency_ms": args.latency,
+            "jitter_ms": args.jitter,
+            "submitters": args.submitters,
+            "submit_batch": args.submit_batch,
+            "agents": args.agents,
+            "max_concurrent_checks": controller.engine.max_concurrency,
+        },
+        "ticks": ticks,
+        "tick_duration": {
+            "mean_seconds": round(sum(tick_totals) / len(tick_totals), 3),
+            "max_seconds": max(tick_totals),
+            "overruns": sum(1 for tick in ticks if tick["slack_seconds"] < 0),
+        },
+        "check_latency": dict(percentiles([latency for values in check_latencies.values() for latency in values]),
+                              by_service={name: percentiles(values) for name, values in check_latencies.items()},
+                              statuses=check_statuses),
+        "submit": {
+            "requests": len(submit_latencies),
+            "flags": submitted,
+            "errors": sum(submitter.errors for submitter in submitters),
+            "requests_per_second": round(len(submit_latencies) / elapsed, 2),
+            "flags_per_second": round(submitted / elapsed, 2),
+            "latency": percentiles(submit_latencies),
+            "http_statuses": statuses,
+            "accepted_flags": sum(submitter.accepted for submitter in submitters),
+        },
+        "workdir": workdir,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the service controller against local stand-in teams without docker")
+    parser.add_argument("--teams", type=int, default=10, help="Number of simulated teams")
+    parser.add_argument("--services", nargs="+", default=list(CHALLENGES), choices=list(CHALLENGES))
+    parser.add_argument("--ticks", type=int, default=3)
+    parser.add_argument("--tick-interval", type=int, default=10, help="Seconds per tick")
+    parser.add_argument("--check-timeout", type=int, default=3, help="Per-service checker timeout in seconds")
+    parser.add_argument("--down-teams", type=int, default=0, help="Teams whose services are never started")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests that hang past the check timeout")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean injected response latency in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Standard deviation of the injected latency in ms")
+    parser.add_argument("--submitters", type=int, default=4, help="Concurrent flag submission clients")
+    parser.add_argument("--submit-batch", type=int, default=50, help="Flags per /submit_flags request")
+    parser.add_argument("--junk", action="store_true", help="Pad every request with invalid flags to --submit-batch")
+    parser.add_argument("--agents", type=int, default=0, help="Run checks on this many local checker agent processes")
+    parser.add_argument("--agent-port", type=int, default=9092)
+    parser.add_argument("--api-port", type=int, default=9090)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the controller's own output")
+    args = parser.parse_args()
+
+    print(f"[*] Load testing {args.teams} teams for {args.ticks} ticks")
+    if args.verbose:
+        report = run(args)
+    else:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            report = run(args)
+
+    result = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+        print(f"[*] Report written to {args.output}")
+    else:
+        print(result)
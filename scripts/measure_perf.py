@@ -42,8 +42,9 @@ if __name__ == "__main__":
     setup_adf.initialize_database(teams, services)
     vpn_subnet = "10.13.13.0/24"
     team_subnet = "172.30.0.0/16"
+    tick_interval = 180
 
-    setup_adf.generate_services(team_count, vpn_subnet, team_subnet)
+    setup_adf.generate_services(team_count, vpn_subnet, team_subnet, tick_interval)
 
     try:
         subprocess.check_call("rm -rf vpn/config", shell=True)
@@ -17,8 +17,11 @@ if [[ -z "$configs" ]]; then
 	exit 1
 fi
 
-config=`echo $configs | head -n 1`
-interface="${config%.*}"
+# One interface per config, sharded deployments have one per host's vpn
+interfaces=""
+for config in $configs; do
+	interfaces="$interfaces ${config%.*}"
+done
 
 if [[ "$(cat /proc/sys/net/ipv4/conf/all/src_valid_mark)" != "1" ]]; then
 	echo "sysctl net.ipv4.conf.all.src_valid_mark=1 is not set" >&2
@@ -29,7 +32,14 @@ fi
 sed -i "s:sysctl -q net.ipv4.conf.all.src_valid_mark=1:echo Skipping setting net.ipv4.conf.all.src_valid_mark:" /usr/bin/wg-quick
 
 # Start WireGuard
-wg-quick up $interface
+for interface in $interfaces; do
+	wg-quick up $interface
+done
+
+# Static team addresses, so subprocess checkers resolve them like the HTTP client does
+for entry in ${CHECKER_HOSTS//,/ }; do
+	echo "${entry#*=} ${entry%%=*}" >> /etc/hosts
+done
 
 # IPv4 kill switch: traffic must be either (1) to the WireGuard interface, (2) marked as a WireGuard packet, (3) to a local address, or (4) to the container network
 # container_ipv4_network="$(ip -o addr show dev eth0 | awk '$3 == "inet" {print $4}')"
@@ -54,7 +64,9 @@ wg-quick up $interface
 # done
 
 shutdown () {
-	wg-quick down $interface
+	for interface in $interfaces; do
+		wg-quick down $interface
+	done
 	exit 0
 }
 
@@ -62,5 +74,17 @@ trap shutdown SIGTERM SIGINT SIGQUIT
 
 python -u service_controller.py &
 
+# Serve the scoreboard/submission API from its own worker processes
+if [[ "$API_MODE" == "standalone" ]]; then
+	gunicorn -w ${API_WORKERS:-4} -k gthread --threads ${API_THREADS:-64} -b 0.0.0.0:9090 wsgi:app &
+fi
+
+# Checker agents on this node for EXECUTION_MODE=agents, agents on other nodes can join too
+if [[ "$EXECUTION_MODE" == "agents" ]]; then
+	for i in $(seq 1 ${LOCAL_AGENTS:-0}); do
+		CONTROLLER_URL=http://127.0.0.1:${AGENT_PORT:-9092} python -u checker_agent.py &
+	done
+fi
+
 sleep infinity &
 wait $!
\ No newline at end of file
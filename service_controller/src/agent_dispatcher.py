@@ -0,0 +1,170 @@
+import asyncio
+import hmac
+import ipaddress
+import itertools
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import AGENT_JOBS
+
+
+# Hands (tick, team, service, flag) jobs to checker agents over HTTP, for EXECUTION_MODE=agents.
+# Agents lease jobs with POST /jobs/lease and report statuses with POST /jobs/result.
+# A lease lasts the job's timeout plus AGENT_LEASE_GRACE, expired leases are handed to another agent
+class AgentDispatcher:
+    def __init__(self):
+        self.port = int(os.getenv('AGENT_PORT', 9092))
+        # Jobs carry every team's flag, only agents on this node can lease them unless set explicitly
+        self.bind = os.getenv('AGENT_BIND', '127.0.0.1')
+        # Shared secret agents send as "Authorization: Bearer <token>", required once agents can connect remotely
+        self.token = os.getenv('AGENT_TOKEN', '')
+        if not self.token and not ipaddress.ip_address(self.bind).is_loopback:
+            raise ValueError("AGENT_TOKEN must be set when AGENT_BIND is not a loopback address")
+        self.lease_grace = float(os.getenv('AGENT_LEASE_GRACE', 2))
+        # Times a job is handed out before it is scored DOWN
+        self.max_attempts = int(os.getenv('AGENT_MAX_ATTEMPTS', 2))
+        self.ids = itertools.count(1)
+        self.jobs = {}  # {job id: job}
+        self.pending = deque()  # Job ids waiting for an agent
+        self.cond = threading.Condition()
+        self.server = None
+
+    def start(self):
+        dispatcher = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                dispatcher.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.bind, self.port), Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever, name='agent-dispatcher', daemon=True)
+        thread.start()
+        print(f"Waiting for checker agents on {self.bind}:{self.port}")
+
+    # Queue a check and wait for an agent's status, cancelling drops the job
+    async def run(self, service_name, tick, team, flag, timeout=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = {
+            'id': next(self.ids), 'tick': tick, 'team': team, 'service': service_name, 'flag': flag,
+            'deadline': time.time() + timeout if timeout is not None else None,
+            'attempts': 0, 'agent': None, 'expires': None, 'loop': loop, 'future': future,
+        }
+        with self.cond:
+            self.jobs[job['id']] = job
+            self.pending.append(job['id'])
+            self.cond.notify_all()
+        try:
+            return await future
+        finally:
+            with self.cond:
+                self.jobs.pop(job['id'], None)
+
+    def handle(self, request):
+        if self.token:
+            supplied = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(supplied.encode(), f'Bearer {self.token}'.encode()):
+                return self.respond(request, 401, {'error': 'Invalid agent token'})
+        try:
+            length = int(request.headers.get('Content-Length', 0))
+            data = json.loads(request.rfile.read(length) or b'{}')
+            agent = str(data['agent'])
+            max_jobs = int(data.get('max_jobs', 1))
+            wait = float(data.get('wait', 10))
+            if not math.isfinite(wait):
+                raise ValueError(wait)
+            results = data.get('results', [])
+            if not isinstance(results, list):
+                raise ValueError(results)
+            for result in results:
+                if not isinstance(result, dict) or not isinstance(result.get('id'), int):
+                    raise ValueError(result)
+        except (ValueError, KeyError, TypeError):
+            return self.respond(request, 400, {'error': 'Invalid request'})
+
+        if request.path == '/jobs/lease':
+            jobs = self.lease(agent, max_jobs, min(max(wait, 0), 30))
+            return self.respond(request, 200, {'jobs': jobs})
+        if request.path == '/jobs/result':
+            accepted = self.complete(agent, results)
+            return self.respond(request, 200, {'accepted': accepted})
+        return self.respond(request, 404, {'error': 'Not found'})
+
+    def respond(self, request, code, body):
+        data = json.dumps(body).encode()
+        request.send_response(code)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    # Hand up to max_jobs jobs to an agent, long-polls for up to wait seconds
+    def lease(self, agent, max_jobs, wait):
+        end = time.time() + wait
+        with self.cond:
+            while True:
+                self._expire_leases()
+                jobs = []
+                while self.pending and len(jobs) < max_jobs:
+                    job = self.jobs.get(self.pending.popleft())
+                    if job is None:
+                        # Cancelled while queued, e.g. its tick ended
+                        continue
+                    now = time.time()
+                    timeout = max(0.1, job['deadline'] - now) if job['deadline'] is not None else None
+                    job['attempts'] += 1
+                    job['agent'] = agent
+                    job['expires'] = now + (timeout if timeout is not None else 60) + self.lease_grace
+                    jobs.append({'id': job['id'], 'tick': job['tick'], 'team': job['team'],
+                                 'service': job['service'], 'flag': job['flag'], 'timeout': timeout})
+                    AGENT_JOBS.inc('leased')
+                remaining = end - time.time()
+                if jobs or remaining <= 0:
+                    return jobs
+                # Wake up at least every second to expire leases of lost agents
+                self.cond.wait(min(remaining, 1))
+
+    # Requeue jobs whose agent went quiet, or score them DOWN once out of attempts
+    def _expire_leases(self):
+        now = time.time()
+        for job in list(self.jobs.values()):
+            if job['expires'] is None or job['expires'] > now:
+                continue
+            print(f"Lease of job {job['id']} held by agent {job['agent']} expired")
+            job['agent'], job['expires'] = None, None
+            if job['attempts'] >= self.max_attempts:
+                AGENT_JOBS.inc('failed')
+                self._resolve(job, "DOWN")
+            else:
+                AGENT_JOBS.inc('requeued')
+                self.pending.appendleft(job['id'])
+
+    # Record statuses reported by an agent, results of jobs that were reassigned or whose tick
+    # already ended are ignored so every check is scored once
+    def complete(self, agent, results):
+        accepted = 0
+        with self.cond:
+            for result in results:
+                job = self.jobs.get(result.get('id'))
+                if job is None or job['agent'] != agent:
+                    AGENT_JOBS.inc('stale')
+                    continue
+                job['agent'], job['expires'] = None, None
+                AGENT_JOBS.inc('completed')
+                self._resolve(job, str(result.get('status', 'DOWN')).strip())
+                accepted += 1
+        return accepted
+
+    def _resolve(self, job, status):
+        def set_status(future=job['future']):
+            if not future.done():
+                future.set_result(status)
+        job['loop'].call_soon_threadsafe(set_status)
@@ -0,0 +1,77 @@
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from checker_operations import CheckerOperations
+
+
+# Checker agent for EXECUTION_MODE=agents. Leases jobs from the controller, runs the checkers
+# locally and reports the statuses back. Start as many as needed, on any node that can reach the teams:
+#   CONTROLLER_URL=http://service_controller:9092 python checker_agent.py
+class CheckerAgent:
+    def __init__(self):
+        self.controller_url = os.getenv('CONTROLLER_URL', 'http://127.0.0.1:9092').rstrip('/')
+        self.name = os.getenv('AGENT_NAME', f'{socket.gethostname()}-{os.getpid()}')
+        # Checks run at the same time by this agent
+        self.concurrency = int(os.getenv('AGENT_CONCURRENCY', 16))
+        self.session = requests.Session()
+        token = os.getenv('AGENT_TOKEN')
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+        self.checkers = CheckerOperations(os.getenv('CHECKER_DIR', 'checkers'))
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='agent-checker')
+        # Free check slots, jobs are only leased when a slot is free
+        self.slots = threading.Semaphore(self.concurrency)
+
+    def post(self, path, body, timeout):
+        response = self.session.post(self.controller_url + path, json=dict(body, agent=self.name), timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def run(self):
+        print(f"Agent {self.name} leasing jobs from {self.controller_url}")
+        while True:
+            self.slots.acquire()
+            free = 1
+            while free < self.concurrency and self.slots.acquire(blocking=False):
+                free += 1
+            try:
+                jobs = self.post('/jobs/lease', {'max_jobs': free, 'wait': 10}, timeout=30)['jobs']
+            except (requests.RequestException, ValueError) as e:
+                print(f"Unable to lease jobs: {e}")
+                jobs = []
+                time.sleep(1)
+            for _ in range(free - len(jobs)):
+                self.slots.release()
+            for job in jobs:
+                self.executor.submit(self.run_job, job)
+
+    def run_job(self, job):
+        try:
+            try:
+                status = self.checkers.run(job['service'], job['team'], job['flag'], job['timeout'])
+            except Exception as e:
+                print(f"Checker for team {job['team']} raised: {e}")
+                status = "DOWN"
+            self.report(job, status)
+        finally:
+            self.slots.release()
+
+    # Retry a few times, the controller requeues the job when its lease expires anyway
+    def report(self, job, status):
+        for attempt in range(3):
+            try:
+                self.post('/jobs/result', {'results': [{'id': job['id'], 'status': status}]}, timeout=5)
+                print(f"Tick {job['tick']} {job['service']} team {job['team']}: {status}")
+                return
+            except requests.RequestException as e:
+                print(f"Unable to report job {job['id']}: {e}, retrying ({attempt+1}/3)")
+                time.sleep(0.5)
+
+
+if __name__ == '__main__':
+    CheckerAgent().run()
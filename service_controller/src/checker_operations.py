@@ -0,0 +1,134 @@
+import importlib.util
+import inspect
+import os
+import subprocess
+import threading
+import time
+import requests
+from http_client import CheckerHTTPClient
+from metrics import CHECKER_CALL_SECONDS
+import tracing
+
+
+# Status of a check that couldn't connect to the service, only these trip the circuit breaker.
+# Scored as DOWN
+UNREACHABLE = "UNREACHABLE"
+
+
+# Keyword arguments a plugin callable accepts, None if it takes **kwargs
+def accepted_kwargs(func):
+    params = inspect.signature(func).parameters.values()
+    if any(param.kind == param.VAR_KEYWORD for param in params):
+        return None
+    return {param.name for param in params}
+
+
+# Only pass the options a plugin declares, so older plugins keep working
+def call_plugin(func, accepted, *args, **options):
+    if accepted is not None:
+        options = {name: value for name, value in options.items() if name in accepted}
+    return func(*args, **options)
+
+
+class CheckerOperations:
+    def __init__(self, checker_dir='checkers'):
+        self.checker_dir = checker_dir
+        # "plugin" imports checkers once and calls them in-process,
+        # "subprocess" runs every check in a fresh interpreter
+        self.mode = os.getenv('CHECKER_MODE', 'plugin')
+        # Comma separated services that must always run as a subprocess (untrusted/legacy)
+        self.subprocess_services = set(
+            s.strip() for s in os.getenv('SUBPROCESS_CHECKERS', '').split(',') if s.strip()
+        )
+        self.plugins = {}
+        self.plugin_kwargs = {}  # {service_name: (check kwargs, plant_flag kwargs)}
+        # One lock per service, so concurrent first checks import a checker only once
+        self.load_locks = {}
+        self.load_locks_lock = threading.Lock()
+        # Keep-alive HTTP client handed to plugins that accept an `http` argument
+        self.http = CheckerHTTPClient()
+
+    def checker_path(self, service_name):
+        return os.path.join(self.checker_dir, f"{service_name}_checker.py")
+
+    def has_checker(self, service_name):
+        return os.path.exists(self.checker_path(service_name))
+
+    # Import checker module once and cache it
+    def load_plugin(self, service_name):
+        if service_name in self.plugins:
+            return self.plugins[service_name]
+
+        with self.load_locks_lock:
+            lock = self.load_locks.setdefault(service_name, threading.Lock())
+        with lock:
+            if service_name not in self.plugins:
+                self.plugins[service_name] = self._import_plugin(service_name)
+        return self.plugins[service_name]
+
+    # Import the checker module, None if it doesn't follow the plugin API
+    def _import_plugin(self, service_name):
+        plugin = None
+        if self.mode != 'subprocess' and service_name not in self.subprocess_services:
+            checker_path = self.checker_path(service_name)
+            try:
+                spec = importlib.util.spec_from_file_location(f"{service_name}_checker", checker_path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                if callable(getattr(module, 'check', None)) and callable(getattr(module, 'plant_flag', None)):
+                    plugin = module
+                    self.plugin_kwargs[service_name] = (accepted_kwargs(module.check), accepted_kwargs(module.plant_flag))
+                else:
+                    print(f"Checker for {service_name} has no check/plant_flag, using subprocess mode")
+            except Exception as e:
+                print(f"Unable to load checker plugin for {service_name}: {e}, using subprocess mode")
+        return plugin
+
+    # Run healthcheck and plant flag within timeout seconds, returns service status
+    def run(self, service_name, team, flag, timeout=None):
+        plugin = self.load_plugin(service_name)
+        if plugin is None:
+            return self.run_subprocess(service_name, team, flag, timeout)
+        return self.run_plugin(service_name, plugin, team, flag, timeout)
+
+    def run_plugin(self, service_name, plugin, team, flag, timeout=None):
+        check_kwargs, plant_kwargs = self.plugin_kwargs[service_name]
+        deadline = time.time() + timeout if timeout else None
+        try:
+            options = {'http': self.http}
+            if deadline:
+                options['timeout'] = max(0.1, deadline - time.time())
+            start = time.perf_counter()
+            self.http.reset_connection_failed()
+            with tracing.span('check', 'checker', service=service_name, team=team):
+                result = call_plugin(plugin.check, check_kwargs, f'team{team}', **options)
+            checked = time.perf_counter()
+            CHECKER_CALL_SECONDS.observe(checked - start, service_name, 'check')
+            result = str(result).strip()
+            # Checkers usually catch request errors and return DOWN, the shared client saw the failure
+            if result != "UP" and self.http.connection_failed():
+                result = UNREACHABLE
+            if deadline:
+                options['timeout'] = max(0.1, deadline - time.time())
+            with tracing.span('plant_flag', 'checker', service=service_name, team=team):
+                call_plugin(plugin.plant_flag, plant_kwargs, f'team{team}', flag, **options)
+            CHECKER_CALL_SECONDS.observe(time.perf_counter() - checked, service_name, 'plant_flag')
+        except (ConnectionError, requests.ConnectionError) as e:
+            print(f"Checker for team {team} couldn't connect: {e}")
+            return UNREACHABLE
+        except Exception as e:
+            print(f"Checker for team {team} raised: {e}")
+            return "DOWN"
+        return result
+
+    # Legacy mode - execute healthcheck script in its own interpreter, killed after timeout
+    def run_subprocess(self, service_name, team, flag, timeout=None):
+        print(f"Running checker script for {service_name}")
+        try:
+            with tracing.span('subprocess', 'checker', service=service_name, team=team):
+                result = subprocess.run(['python', self.checker_path(service_name), f'team{team}', flag],
+                                        capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            print(f"Checker for team {team} killed after {timeout}s")
+            return "DOWN"
+        return result.stdout.strip()
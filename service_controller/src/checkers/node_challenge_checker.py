@@ -1,9 +1,9 @@
 import sys
 import requests
 
-def check_node_challenge(team):
+def check_node_challenge(team, timeout=5, http=requests):
     try:
-        response = requests.get(f"http://{team}:3000/health", timeout=5)
+        response = http.get(f"http://{team}:3000/health", timeout=timeout)
         if response.status_code == 200 and "Node.js Challenge is running!" in response.text:
             return "UP"
         else:
@@ -11,13 +11,16 @@ def check_node_challenge(team):
     except requests.RequestException:
         return "DOWN"
 
-def plant_flag(team,flag):
+def plant_flag(team,flag,timeout=5,http=requests):
     try:
-        response=requests.get(f"http://{team}:3000/flag?flag={flag}", timeout=5)
+        response=http.get(f"http://{team}:3000/flag?flag={flag}", timeout=timeout)
     except Exception as e:
         pass
         # print("Error planting flag")
 
+# Plugin entry point used by the service controller
+check = check_node_challenge
+
 if __name__ == "__main__":
     if len(sys.argv) > 2:
         team = sys.argv[1]
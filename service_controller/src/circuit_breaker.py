@@ -0,0 +1,56 @@
+import asyncio
+import os
+from checker_operations import UNREACHABLE
+from metrics import BREAKER_PROBES
+
+
+# Per (service, team) circuit breaker. After BREAKER_THRESHOLD connection failures in a row the
+# full checker only runs again once a TCP connect to the service port succeeds
+class CircuitBreaker:
+    def __init__(self, ports, hosts=None):
+        self.ports = ports  # {service_name: port}
+        # {team host: address}, the CHECKER_HOSTS overrides already parsed by the checker HTTP client
+        self.hosts = hosts or {}
+        # Consecutive connection failures before probing, 0 disables the breaker
+        self.threshold = int(os.getenv('BREAKER_THRESHOLD', 2))
+        self.probe_timeout = float(os.getenv('BREAKER_PROBE_TIMEOUT', 0.5))
+        self.failures = {}  # {(service_name, team): consecutive connection failures}
+
+    def is_open(self, service_name, team):
+        return self.threshold > 0 and self.failures.get((service_name, team), 0) >= self.threshold
+
+    # Whether the full check should run, probes the service first when the circuit is open.
+    # timeout caps the probe timeout, e.g. to the time left in the tick
+    async def allow(self, service_name, team, timeout=None):
+        if not self.is_open(service_name, team):
+            return True
+        reachable = await self.probe(service_name, team, timeout)
+        BREAKER_PROBES.inc(service_name, 'open' if reachable else 'refused')
+        return reachable
+
+    async def probe(self, service_name, team, timeout=None):
+        port = self.ports.get(service_name)
+        if port is None:
+            return True
+        host = f'team{team}'
+        timeout = self.probe_timeout if timeout is None else min(self.probe_timeout, timeout)
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.hosts.get(host, host), port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return True
+
+    # Called with the status reported by every check that ran. Any other status means the
+    # service answered, so only connection failures count
+    def record(self, service_name, team, status):
+        key = (service_name, team)
+        if status == UNREACHABLE:
+            self.failures[key] = self.failures.get(key, 0) + 1
+        else:
+            self.failures.pop(key, None)
@@ -1,27 +1,141 @@
+import os
+import queue
 import sqlite3
+import sys
+import threading
+import time
 from datetime import datetime
 from contextlib import contextmanager
+from metrics import DB_TRANSACTION_SECONDS, DB_WAIT_SECONDS
+from scoring import ATTACK_POINTS, SLA_POINTS, register_functions
+import tracing
 
+# Captures per INSERT, 4 parameters each stays below SQLite's default variable limit
+CAPTURE_BATCH_SIZE = 1000
 
 
-class DatabaseOperations:
-    def __init__(self, db_path='database/ctf.db'):
+class ConnectionPool:
+    def __init__(self, db_path, size, readonly=False, timeout=60.0):
         self.db_path = db_path
-        self.init_db()
+        self.size = size
+        self.readonly = readonly
+        self.timeout = timeout
+        self.name = 'read' if readonly else 'write'
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+        # Connection currently held by each thread, so nested get_db calls reuse it
+        self.local = threading.local()
 
-    @contextmanager
-    def get_db(self):
-        conn = sqlite3.connect(self.db_path, timeout=10.0)
+    # Open a connection, PRAGMAs are applied once here instead of on every checkout
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10.0, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        register_functions(conn)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # 60 second timeout
+        conn.execute('PRAGMA busy_timeout=60000')
+        if self.readonly:
+            conn.execute('PRAGMA query_only=1')
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.opened < self.size
+                if can_open:
+                    self.opened += 1
+            if can_open:
+                try:
+                    return self._connect()
+                except sqlite3.Error:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+            try:
+                conn = self.idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+        # Replace connections that went bad while idle
+        if not self._healthy(conn):
+            conn.close()
+            try:
+                conn = self._connect()
+            except sqlite3.Error:
+                with self.lock:
+                    self.opened -= 1
+                raise
+        return conn
+
+    def release(self, conn):
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self.local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+
+        trace_start = time.time() if tracing.tracer.active else None
+        start = time.perf_counter()
+        conn = self.acquire()
+        acquired = time.perf_counter()
+        DB_WAIT_SECONDS.observe(acquired - start, self.name)
+        self.local.conn = conn
         try:
-            conn.execute('PRAGMA journal_mode=WAL')
-            conn.execute('PRAGMA synchronous=NORMAL')
-            # 60 second timeout
-            conn.execute('PRAGMA busy_timeout=60000')  
             yield conn
             conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
         finally:
-            conn.close()
+            self.local.conn = None
+            self.release(conn)
+            DB_TRANSACTION_SECONDS.observe(time.perf_counter() - acquired, self.name)
+            if trace_start is not None:
+                # Name the span after the DatabaseOperations method that opened the transaction
+                caller = sys._getframe(2).f_code.co_name
+                tracing.tracer.complete(caller, 'db', trace_start,
+                                        {'pool': self.name, 'wait_ms': (acquired - start) * 1000})
+
+
+class DatabaseOperations:
+    def __init__(self, db_path='database/ctf.db'):
+        self.db_path = db_path
+        # SQLite allows a single writer, readers never wait behind it in WAL mode
+        self.write_pool = ConnectionPool(db_path, int(os.getenv('DB_WRITE_POOL_SIZE', 1)))
+        self.read_pool = ConnectionPool(db_path, int(os.getenv('DB_READ_POOL_SIZE', 8)), readonly=True)
+        # Callbacks notified with an event name after scoreboard state is committed
+        self.listeners = []
+        self.init_db()
+
+    # Borrow a pooled connection, readonly ones come from a separate pool
+    def get_db(self, readonly=False):
+        if readonly:
+            return self.read_pool.connection()
+        return self.write_pool.connection()
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def notify(self, event):
+        for callback in self.listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Listener failed for {event}: {e}")
 
     # Initialize database
     def init_db(self):
@@ -39,18 +153,40 @@ class DatabaseOperations:
 
     # Return service names in list format
     def get_services(self):
-        with self.get_db() as conn:
+        with self.get_db(readonly=True) as conn:
             c = conn.cursor()
             c.execute('SELECT name FROM services')
             services = [row['name'] for row in c.fetchall()]
             return services
 
+    # Return the ids of every team
+    def get_team_ids(self):
+        with self.get_db(readonly=True) as conn:
+            c = conn.cursor()
+            c.execute('SELECT id FROM teams')
+            return [row['id'] for row in c.fetchall()]
+
+    # Return {service name: check timeout in seconds}
+    def get_service_timeouts(self):
+        with self.get_db(readonly=True) as conn:
+            c = conn.cursor()
+            c.execute('SELECT name, timeout FROM services')
+            return {row['name']: row['timeout'] for row in c.fetchall()}
+
+    # Return {service name: port}
+    def get_service_ports(self):
+        with self.get_db(readonly=True) as conn:
+            c = conn.cursor()
+            c.execute('SELECT name, port FROM services')
+            return {row['name']: row['port'] for row in c.fetchall()}
+
     # Update current service status to UP or DOWN 
     def update_service_status(self, service_name, status, team):
         with self.get_db() as conn:
             c = conn.cursor()
             c.execute('''UPDATE current_status SET status = ?, last_updated = ? WHERE team_id = ? AND service_name = ?''', (status, datetime.now(), team, service_name))
             conn.commit()
+        self.notify('status')
 
     # Update SLA score if service is UP
     def update_service_score(self, service_name, status, team, tick):
@@ -60,9 +196,10 @@ class DatabaseOperations:
                 try:
                     with self.get_db() as conn:
                         c = conn.cursor()
-                        c.execute('''UPDATE teams SET sla_points = sla_points + 10 WHERE id = ?''', (team,))
+                        c.execute('''UPDATE teams SET sla_points = sla_points + ? WHERE id = ?''', (SLA_POINTS, team))
+                        self.log_score_events(c, [('sla', team, service_name, SLA_POINTS)])
                         conn.commit()
-                        print(f"Added 10 SLA points to Team {team} for {service_name} being UP")
+                        print(f"Added {SLA_POINTS} SLA points to Team {team} for {service_name} being UP")
                     return
                 except sqlite3.OperationalError as e:
                     if "disk I/O error" in str(e):
@@ -75,32 +212,148 @@ class DatabaseOperations:
     def add_attack_points(self, team_id, num_flags):
         with self.get_db() as conn:
             c = conn.cursor()
-            points_to_add = num_flags * 10
+            points_to_add = num_flags * ATTACK_POINTS
             c.execute('''UPDATE teams SET attack_points = attack_points + ? WHERE id = ?''', 
                      (points_to_add, team_id))
+            self.log_score_events(c, [('attack', team_id, None, points_to_add)])
             conn.commit()
 
-    # Calculate and update final scores for all teams at the end of a round
+    # Append to the score event log, events get their tick when the round is scored
+    def log_score_events(self, c, events):
+        c.executemany('''INSERT INTO score_events (kind, team_id, service_name, points) VALUES (?, ?, ?, ?)''', events)
+
+    # Calculate and update final scores for all teams at the end of a round, set-based
     def calculate_round_score(self, tick):
         with self.get_db() as conn:
             c = conn.cursor()
-            c.execute('''SELECT id, sla_points, attack_points FROM teams''')
-            teams = c.fetchall()
-            
-            for team in teams:
-                # Calculate round score using formula: sla * (1 + attack)
-                sla = team['sla_points']
-                attack = team['attack_points']
-                round_score = sla * (1 + attack)
-                
-                # Update total score and reset round points
-                c.execute('''UPDATE teams 
-                           SET score = score + ?,
-                               sla_points = 0,
-                               attack_points = 0 
-                           WHERE id = ?''', (round_score, team['id']))
-            
-            conn.commit()
+            # Seal events logged since the last round into this tick
+            c.execute('''UPDATE score_events SET tick = ? WHERE tick IS NULL''', (tick,))
+
+            # Keep how every team got its score for /history
+            c.execute('''INSERT OR REPLACE INTO score_history (tick, team_id, sla_points, attack_points, delta, score)
+                       SELECT ?, id, sla_points, attack_points,
+                              round_score(sla_points, attack_points),
+                              score + round_score(sla_points, attack_points)
+                       FROM teams''', (tick,))
+
+            # Round score using formula from scoring.round_score, then reset round points
+            c.execute('''UPDATE teams 
+                       SET score = score + round_score(sla_points, attack_points),
+                           sla_points = 0,
+                           attack_points = 0''')
+        self.notify('score')
+
+    # Per-tick score and status series between two ticks, bucketed by step ticks.
+    # Scores and statuses are taken at the end of each bucket, point components are summed over it
+    def get_history(self, first_tick, last_tick, step, team_ids=None):
+        team_filter = ''
+        params = [first_tick, last_tick]
+        if team_ids:
+            team_filter = ' AND team_id IN (%s)' % ','.join('?' * len(team_ids))
+            params += list(team_ids)
+        params += [first_tick, step]
+
+        with self.get_db(readonly=True) as conn:
+            c = conn.cursor()
+            # SQLite takes bare columns from the row holding MAX(tick)
+            c.execute('''SELECT MAX(tick) AS tick, team_id, score,
+                              SUM(delta) AS delta, SUM(sla_points) AS sla_points, SUM(attack_points) AS attack_points
+                       FROM score_history
+                       WHERE tick >= ? AND tick <= ?%s
+                       GROUP BY (tick - ?) / ?, team_id
+                       ORDER BY tick, team_id''' % team_filter,
+                      params)
+            scores = c.fetchall()
+            c.execute('''SELECT MAX(tick) AS tick, team_id, service_name, status
+                       FROM status_history
+                       WHERE tick >= ? AND tick <= ?%s
+                       GROUP BY (tick - ?) / ?, team_id, service_name
+                       ORDER BY tick, team_id''' % team_filter,
+                      params)
+            statuses = c.fetchall()
+        return scores, statuses
+
+    # Shared game state published by the controller for standalone API workers
+    def get_state(self):
+        with self.get_db(readonly=True) as conn:
+            c = conn.cursor()
+            c.execute('SELECT key, value FROM game_state')
+            return {row['key']: row['value'] for row in c.fetchall()}
+
+    def set_state(self, **values):
+        with self.get_db() as conn:
+            c = conn.cursor()
+            c.executemany('''INSERT INTO game_state (key, value) VALUES (?, ?)
+                           ON CONFLICT(key) DO UPDATE SET value = excluded.value''', values.items())
+
+    # Flags inserted after the given rowid, used to keep API worker flag indexes in sync
+    def get_flags_since(self, rowid, min_round):
+        with self.get_db(readonly=True) as conn:
+            c = conn.cursor()
+            c.execute('''SELECT rowid, flag, round_id, team_id, service_name FROM current_flags
+                       WHERE rowid > ? AND round_id >= ? ORDER BY rowid''', (rowid, min_round))
+            return c.fetchall()
+
+    # Move up to batch_size flags of rounds before before_round from current_flags to the archive,
+    # returns the number of flags moved
+    def archive_flags(self, before_round, batch_size):
+        with self.get_db() as conn:
+            c = conn.cursor()
+            table = self.archive_table(c)
+            # Never move the newest row, API workers sync on rowids and SQLite would hand it out again
+            c.execute('''SELECT rowid FROM current_flags
+                       WHERE round_id < ? AND rowid < (SELECT MAX(rowid) FROM current_flags)
+                       ORDER BY round_id LIMIT ?''', (before_round, batch_size))
+            rowids = [(row['rowid'],) for row in c.fetchall()]
+            c.executemany(f'''INSERT OR IGNORE INTO {table} (flag, round_id, team_id, service_name, timestamp)
+                            SELECT flag, round_id, team_id, service_name, timestamp FROM current_flags
+                            WHERE rowid = ?''', rowids)
+        # Deleted only once the archive copy is committed. A transaction across an attached WAL
+        # database is not atomic, a crash in between leaves copies that INSERT OR IGNORE skips next time
+        with self.get_db() as conn:
+            conn.cursor().executemany('''DELETE FROM current_flags WHERE rowid = ?''', rowids)
+        return len(rowids)
+
+    # Archived flags go to flags_archive, or to a separate database file when ARCHIVE_DB is set
+    def archive_table(self, c):
+        archive_db = os.getenv('ARCHIVE_DB')
+        if not archive_db:
+            return 'flags_archive'
+        attached = [row['name'] for row in c.execute('PRAGMA database_list')]
+        if 'archive' not in attached:
+            c.execute('ATTACH DATABASE ? AS archive', (archive_db,))
+            c.execute('PRAGMA archive.journal_mode=WAL')
+            c.execute('''CREATE TABLE IF NOT EXISTS archive.flags_archive
+                       (flag TEXT PRIMARY KEY,
+                        round_id INTEGER NOT NULL,
+                        team_id INTEGER NOT NULL,
+                        service_name TEXT NOT NULL,
+                        timestamp DATETIME NOT NULL)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS archive.flags_archive_round ON flags_archive (round_id, team_id)''')
+        return 'archive.flags_archive'
+
+    # Record captures in the ledger shared by every process, one INSERT per batch of flags.
+    # Returns the flags that were new for this team, their attack points are added in the same transaction
+    def add_captures(self, team_id, captured, tick):
+        new_flags = set()
+        with self.get_db() as conn:
+            c = conn.cursor()
+            for i in range(0, len(captured), CAPTURE_BATCH_SIZE):
+                batch = captured[i:i + CAPTURE_BATCH_SIZE]
+                c.execute('''INSERT OR IGNORE INTO captures (flag, team_id, flag_tick, tick) VALUES %s RETURNING flag'''
+                          % ', '.join(['(?, ?, ?, ?)'] * len(batch)),
+                          [value for flag, flag_tick in batch for value in (flag, team_id, flag_tick, tick)])
+                new_flags.update(row['flag'] for row in c.fetchall())
+            if new_flags:
+                self.add_attack_points(team_id, len(new_flags))
+        return new_flags
+
+    # Captures of flags planted since min_tick, warms the submission filter after a restart
+    def get_captures_since(self, min_tick):
+        with self.get_db(readonly=True) as conn:
+            c = conn.cursor()
+            c.execute('''SELECT flag, team_id, flag_tick FROM captures WHERE flag_tick >= ?''', (min_tick,))
+            return c.fetchall()
 
     # Insert generated flags into database
     def insert_flag(self, service_name,tick, team, flag):
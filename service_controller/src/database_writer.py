@@ -0,0 +1,149 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from metrics import DB_DROPPED, DB_LOCKED
+from scoring import SLA_POINTS
+
+
+class DatabaseWriter:
+    def __init__(self, db):
+        self.db = db
+        # Max mutations committed in one transaction
+        self.batch_size = int(os.getenv('DB_BATCH_SIZE', 1000))
+        # Seconds to wait for more mutations before committing a batch
+        self.batch_linger = float(os.getenv('DB_BATCH_LINGER', 0.05))
+        self.queue = queue.Queue()
+        # Mutations dropped since the last flush, reported by flush()
+        self.dropped = 0
+        self.last_error = None
+        self.error_lock = threading.Lock()
+        self.writer_thread = threading.Thread(target=self._run, name='db-writer')
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    # Queue generated flag for insertion
+    def insert_flag(self, service_name, tick, team, flag):
+        self.queue.put(('flag', (flag, tick, team, service_name, datetime.now())))
+
+    # Queue current service status update, also recorded in status_history when the tick is known.
+    # Both rows are one mutation so a batch can't split them
+    def update_service_status(self, service_name, status, team, tick=None):
+        history = (tick, team, service_name, status) if tick is not None else None
+        self.queue.put(('status', ((status, datetime.now(), team, service_name), history)))
+
+    # Queue SLA points if service is UP
+    def update_service_score(self, service_name, status, team, tick):
+        if status.upper() == "UP":
+            self.queue.put(('sla', (team, service_name)))
+
+    # Block until everything queued before this call is committed. Returns False if the wait
+    # timed out or mutations were dropped since the last flush, the reason is in last_error
+    def flush(self, timeout=None):
+        done = threading.Event()
+        self.queue.put(('flush', done))
+        if not done.wait(timeout):
+            self.last_error = f"flush timed out after {timeout}s"
+            return False
+        with self.error_lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped == 0
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.batch_linger
+            while len(batch) < self.batch_size and batch[-1][0] != 'flush':
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+
+            flushes = [item for kind, item in batch if kind == 'flush']
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # Keep the writer alive, a dead writer would block every later flush
+                self._drop(len(batch) - len(flushes), e)
+            finally:
+                for done in flushes:
+                    done.set()
+
+    def _drop(self, count, error):
+        DB_DROPPED.inc(amount=count)
+        print(f"Dropped {count} mutations: {error}")
+        with self.error_lock:
+            self.dropped += count
+            self.last_error = str(error)
+
+    # Commit a batch of mutations in a single transaction
+    def _write_batch(self, batch):
+        flags = [item for kind, item in batch if kind == 'flag']
+        statuses = [item for kind, item in batch if kind == 'status']
+        sla_events = [('sla', item[0], item[1], SLA_POINTS) for kind, item in batch if kind == 'sla']
+        if not (flags or statuses or sla_events):
+            return
+
+        retries = 3
+        for attempt in range(retries):
+            try:
+                with self.db.get_db() as conn:
+                    self._execute(conn.cursor(), flags, statuses, sla_events)
+                print(f"Committed {len(flags)} flags, {len(statuses)} statuses, {len(sla_events)} SLA results")
+                if statuses:
+                    self.db.notify('status')
+                return
+            except sqlite3.OperationalError as e:
+                DB_LOCKED.inc()
+                print(f"Batch write failed: {e}, retrying ({attempt+1}/{retries})")
+                time.sleep(1)
+            except sqlite3.Error as e:
+                # A bad row fails the whole batch, commit the others one by one
+                print(f"Batch write failed: {e}, writing row by row")
+                self._write_rows(flags, statuses, sla_events)
+                if statuses:
+                    self.db.notify('status')
+                return
+        self._drop(len(flags) + len(statuses) + len(sla_events),
+                   f"database still locked after {retries} attempts")
+
+    def _execute(self, c, flags, statuses, sla_events):
+        sla_points = {}
+        for _, team, _, points in sla_events:
+            sla_points[team] = sla_points.get(team, 0) + points
+        # Flags are random or signed, a repeated one is already stored
+        c.executemany('''INSERT OR IGNORE INTO current_flags (flag, round_id, team_id, service_name, timestamp) VALUES (?, ?, ?, ?, ?)''', flags)
+        c.executemany('''UPDATE current_status SET status = ?, last_updated = ? WHERE team_id = ? AND service_name = ?''',
+                      [status for status, _ in statuses])
+        c.executemany('''INSERT OR REPLACE INTO status_history (tick, team_id, service_name, status) VALUES (?, ?, ?, ?)''',
+                      [history for _, history in statuses if history is not None])
+        c.executemany('''UPDATE teams SET sla_points = sla_points + ? WHERE id = ?''',
+                      [(points, team) for team, points in sla_points.items()])
+        self.db.log_score_events(c, sla_events)
+
+    # One transaction where each mutation is its own savepoint, mutations that fail are rolled back,
+    # dropped and reported
+    def _write_rows(self, flags, statuses, sla_events):
+        failed = 0
+        error = None
+        with self.db.get_db() as conn:
+            c = conn.cursor()
+            rows = ([([flag], [], []) for flag in flags] + [([], [status], []) for status in statuses] +
+                    [([], [], [event]) for event in sla_events])
+            for row in rows:
+                c.execute('SAVEPOINT row')
+                try:
+                    self._execute(c, *row)
+                    c.execute('RELEASE row')
+                except sqlite3.OperationalError:
+                    raise
+                except sqlite3.Error as e:
+                    c.execute('ROLLBACK TO row')
+                    c.execute('RELEASE row')
+                    failed += 1
+                    error = e
+                    print(f"Dropped row {row}: {e}")
+        if failed:
+            self._drop(failed, error)
@@ -0,0 +1,44 @@
+import os
+import threading
+import time
+
+
+# Moves flags of rounds that fell out of the retention window from current_flags
+# to the archive, so the hot table only holds the last few ticks
+class FlagArchiver:
+    def __init__(self, db, oldest_tick):
+        self.db = db
+        # Callable returning the oldest round whose flags must stay in current_flags
+        self.oldest_tick = oldest_tick
+        # Seconds between archive runs
+        self.interval = float(os.getenv('ARCHIVE_INTERVAL', 60))
+        # Flags moved per transaction, keeps the write lock short for the tick writer
+        self.batch_size = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+        self.archived = 0
+        self.archiver_thread = threading.Thread(target=self._run, name='flag-archiver')
+        self.archiver_thread.daemon = True
+        self.archiver_thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.archive()
+            except Exception as e:
+                print(f"Flag archival failed: {e}")
+
+    # Archive every flag older than the retention window, one batch at a time
+    def archive(self):
+        before_round = self.oldest_tick()
+        moved = 0
+        while True:
+            count = self.db.archive_flags(before_round, self.batch_size)
+            moved += count
+            if count < self.batch_size:
+                break
+            # Let queued tick writes in between batches
+            time.sleep(0.01)
+        if moved:
+            self.archived += moved
+            print(f"Archived {moved} flags of rounds before {before_round}")
+        return moved
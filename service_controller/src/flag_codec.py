@@ -0,0 +1,44 @@
+import hashlib
+import hmac
+import os
+import struct
+
+# team id, service index, tick, nonce
+PAYLOAD_FORMAT = '>HHI8s'
+PAYLOAD_SIZE = struct.calcsize(PAYLOAD_FORMAT)
+MAC_SIZE = 16
+FLAG_LENGTH = len("flag{}") + 2 * (PAYLOAD_SIZE + MAC_SIZE)
+
+
+# Self-authenticating flags: owner, service and tick are encoded in the flag
+# and signed with a server secret, so validating one needs no storage lookup
+class FlagCodec:
+    def __init__(self, secret, services):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        # Sorted so every process maps service names to the same index
+        self.services = sorted(services)
+
+    def _mac(self, payload):
+        return hmac.new(self.secret, payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+    def encode(self, team, service_name, tick):
+        payload = struct.pack(PAYLOAD_FORMAT, team, self.services.index(service_name), tick, os.urandom(8))
+        return "flag{" + (payload + self._mac(payload)).hex() + "}"
+
+    # Returns (team_id, service_name, tick) or None for forged/malformed flags
+    def decode(self, flag):
+        if len(flag) != FLAG_LENGTH or not flag.startswith("flag{") or not flag.endswith("}"):
+            return None
+        try:
+            raw = bytes.fromhex(flag[5:-1])
+        except ValueError:
+            return None
+
+        payload, mac = raw[:PAYLOAD_SIZE], raw[PAYLOAD_SIZE:]
+        if not hmac.compare_digest(mac, self._mac(payload)):
+            return None
+
+        team, service_index, tick, _ = struct.unpack(PAYLOAD_FORMAT, payload)
+        if service_index >= len(self.services):
+            return None
+        return team, self.services[service_index], tick
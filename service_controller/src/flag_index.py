@@ -0,0 +1,37 @@
+import threading
+
+
+class FlagIndex:
+    def __init__(self, validity_ticks=1, expired_ticks=1):
+        # Number of ticks a planted flag can be submitted for, 1 = current tick only
+        self.validity_ticks = validity_ticks
+        # Flags are kept this many ticks longer so they can be reported as expired
+        self.retention_ticks = validity_ticks + expired_ticks
+        self.flags = {}  # {flag: (team_id, service_name, tick)}
+        self.ticks = {}  # {tick: [flags]}
+        # Only writers take the lock, lookups are plain dict reads
+        self.lock = threading.Lock()
+
+    def add(self, flag, team, service_name, tick):
+        with self.lock:
+            self.flags[flag] = (team, service_name, tick)
+            self.ticks.setdefault(tick, []).append(flag)
+
+    # Returns (team_id, service_name, tick) or None if the flag is unknown
+    def lookup(self, flag):
+        return self.flags.get(flag)
+
+    def is_valid(self, flag_tick, current_tick):
+        return current_tick - self.validity_ticks < flag_tick <= current_tick
+
+    # Oldest tick whose flags are still kept
+    def oldest_tick(self, current_tick):
+        return current_tick - self.retention_ticks + 1
+
+    # Drop flags of ticks that fell out of the retention window
+    def expire(self, current_tick):
+        with self.lock:
+            expired = [tick for tick in self.ticks if tick < self.oldest_tick(current_tick)]
+            for tick in expired:
+                for flag in self.ticks.pop(tick):
+                    self.flags.pop(flag, None)
@@ -0,0 +1,104 @@
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+import tracing
+
+
+# Parse "key=value,key=value" settings such as CHECKER_HOSTS into a dict, values passed through convert
+def parse_pairs(value, convert=str):
+    pairs = {}
+    for entry in value.split(','):
+        if '=' not in entry:
+            continue
+        key, item = entry.split('=', 1)
+        pairs[key.strip()] = convert(item.strip())
+    return pairs
+
+
+# Keep-alive HTTP client shared by all checker plugins, with one connection pool per team host
+class CheckerHTTPClient:
+    def __init__(self):
+        # Connections kept open per team service (host and port)
+        self.pool_size = int(os.getenv('CHECKER_POOL_SIZE', 4))
+        self.connect_timeout = float(os.getenv('CHECKER_CONNECT_TIMEOUT', 3))
+        self.read_timeout = float(os.getenv('CHECKER_READ_TIMEOUT', 5))
+        # Seconds a resolved team address is reused
+        self.dns_ttl = float(os.getenv('CHECKER_DNS_TTL', 60))
+        # Static host overrides, e.g. CHECKER_HOSTS="team1=10.0.0.2"
+        self.hosts = parse_pairs(os.getenv('CHECKER_HOSTS', ''))
+        # One session per host:port, a urllib3 pool only serves one port and pool_connections=1
+        # would close the keep-alive connections of a team's other services
+        self.sessions = {}  # {host:port: requests.Session}
+        self.dns_cache = {}  # {host: (address, expires)}
+        self.lock = threading.Lock()
+        # Whether a request of the current check failed to connect, tracked per worker thread
+        self.local = threading.local()
+
+    # Start tracking connection failures of the check running on this thread
+    def reset_connection_failed(self):
+        self.local.connection_failed = False
+
+    def connection_failed(self):
+        return getattr(self.local, 'connection_failed', False)
+
+    def resolve(self, host):
+        if host in self.hosts:
+            return self.hosts[host]
+        cached = self.dns_cache.get(host)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        address = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+        self.dns_cache[host] = (address, time.time() + self.dns_ttl)
+        return address
+
+    def session(self, netloc):
+        session = self.sessions.get(netloc)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(netloc)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self.sessions[netloc] = session
+        return session
+
+    # Same interface as requests.request, timeout caps the configured connect/read timeouts
+    def request(self, method, url, timeout=None, headers=None, **kwargs):
+        parts = urlsplit(url)
+        host = parts.hostname
+        headers = dict(headers or {})
+        if parts.scheme == 'http':
+            # Connect to the cached address, https keeps the hostname for certificate checks
+            try:
+                address = self.resolve(host)
+            except socket.gaierror as e:
+                raise requests.ConnectionError(f"Unable to resolve {host}: {e}")
+            headers.setdefault('Host', parts.netloc)
+            netloc = address if parts.port is None else f"{address}:{parts.port}"
+            url = parts._replace(netloc=netloc).geturl()
+
+        connect_timeout, read_timeout = self.connect_timeout, self.read_timeout
+        if timeout is not None:
+            connect_timeout, read_timeout = min(connect_timeout, timeout), min(read_timeout, timeout)
+
+        try:
+            with tracing.span(f'{method} {parts.path}', 'http', host=host):
+                return self.session(parts.netloc).request(method, url, headers=headers, timeout=(connect_timeout, read_timeout), **kwargs)
+        except requests.ConnectionError:
+            # Container may have come back with a new address
+            self.dns_cache.pop(host, None)
+            self.local.connection_failed = True
+            raise
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
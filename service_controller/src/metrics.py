@@ -0,0 +1,210 @@
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CHECK_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60)
+TICK_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 180, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Values are kept in one dict per thread, so recording is a plain dict update without locks.
+# Shards are only merged when /metrics is scraped
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.local = threading.local()
+        self.shards = []  # [(thread, {label values: value})]
+        self.retired = {}  # Merged values of finished threads
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def shard(self):
+        values = getattr(self.local, 'values', None)
+        if values is None:
+            values = self.local.values = {}
+            with self.lock:
+                # Request threads come and go, fold finished ones in before the list grows
+                if len(self.shards) >= 64:
+                    self._retire()
+                self.shards.append((threading.current_thread(), values))
+        return values
+
+    def _retire(self):
+        alive = []
+        for thread, values in self.shards:
+            if thread.is_alive():
+                alive.append((thread, values))
+            else:
+                for key, value in values.copy().items():
+                    self.retired[key] = self.merge(self.retired.get(key), value)
+        self.shards = alive
+
+    def merge(self, total, value):
+        return value if total is None else total + value
+
+    # {label values: value} summed over every thread
+    def collect(self):
+        with self.lock:
+            self._retire()
+            totals = dict(self.retired)
+            for _, values in self.shards:
+                for key, value in values.copy().items():
+                    totals[key] = self.merge(totals.get(key), value)
+        return totals
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{format_labels(self.labels, key)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        values = self.shard()
+        values[labels] = values.get(labels, 0) + amount
+
+
+# Gauge built from increments and decrements, e.g. work in progress
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+# Gauge read from a callback when scraped, func returns a number or {label values: number}
+class GaugeFunc(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, description, func, labels=()):
+        super().__init__(name, description, labels)
+        self.func = func
+
+    def collect(self):
+        value = self.func()
+        return value if isinstance(value, dict) else {(): value}
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        values = self.shard()
+        counts = values.get(labels)
+        if counts is None:
+            # One slot per bucket, one for +Inf, then the sum
+            counts = values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def merge(self, total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for key, counts in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = format_labels(self.labels, key, f'le="{format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            labels = format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+# Prometheus text exposition of every metric
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Serve /metrics from a separate port, for processes that don't run the Flask app
+def start_server(port):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# Tick engine and checkers
+CHECK_SECONDS = Histogram('ctf_check_duration_seconds', 'Time to check a team service and plant its flag',
+                          ('service', 'team'), CHECK_BUCKETS)
+CHECKS = Counter('ctf_checks_total', 'Finished checks by resulting status', ('service', 'status'))
+CHECKER_CALL_SECONDS = Histogram('ctf_checker_call_duration_seconds', 'Time spent in checker plugin calls',
+                                 ('service', 'call'), CHECK_BUCKETS)
+CHECKS_IN_PROGRESS = Gauge('ctf_checks_in_progress', 'Checks of the current tick by state', ('state',))
+BREAKER_PROBES = Counter('ctf_breaker_probes_total', 'TCP probes of services with an open circuit breaker',
+                         ('service', 'result'))
+AGENT_JOBS = Counter('ctf_agent_jobs_total', 'Checker agent job events', ('event',))
+TICK_PHASE_SECONDS = Histogram('ctf_tick_phase_duration_seconds', 'Duration of each phase of a tick',
+                               ('phase',), TICK_BUCKETS)
+
+# Flag submission
+SUBMIT_SECONDS = Histogram('ctf_submit_request_duration_seconds', 'Flag submission request latency', ('endpoint',))
+SUBMITTED_FLAGS = Counter('ctf_submitted_flags_total', 'Submitted flags by verdict', ('verdict',))
+SUBMIT_REJECTED = Counter('ctf_submit_rejected_requests_total', 'Submission requests refused before judging',
+                          ('reason',))
+
+# Database
+DB_WAIT_SECONDS = Histogram('ctf_db_connection_wait_seconds', 'Time waiting for a pooled SQLite connection', ('pool',))
+DB_TRANSACTION_SECONDS = Histogram('ctf_db_transaction_duration_seconds',
+                                   'Time a pooled SQLite connection is held until commit or rollback', ('pool',))
+DB_LOCKED = Counter('ctf_db_locked_errors_total', 'Writes retried because the database was locked or busy')
+DB_DROPPED = Counter('ctf_db_dropped_writes_total', 'Queued writes that could not be committed')
+
+# Process
+THREADS = GaugeFunc('ctf_threads', 'Live threads in this process', threading.active_count)
+PROCESS = GaugeFunc('ctf_process_info', 'Process serving these metrics', lambda: {(os.getpid(),): 1}, ('pid',))
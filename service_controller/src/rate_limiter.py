@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    # Take n tokens, returns seconds to wait before retrying if there aren't enough
+    def take(self, n, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if n <= self.tokens:
+            self.tokens -= n
+            return 0
+        return (n - self.tokens) / self.rate
+
+
+# Per-team request and flag rate limits for flag submission, kept in memory
+class RateLimiter:
+    def __init__(self):
+        # Disabled when set to 0
+        self.requests_per_second = float(os.getenv('SUBMIT_REQUESTS_PER_SECOND', 10))
+        self.request_burst = float(os.getenv('SUBMIT_REQUEST_BURST', 20))
+        self.flags_per_second = float(os.getenv('SUBMIT_FLAGS_PER_SECOND', 500))
+        self.flag_burst = float(os.getenv('SUBMIT_FLAG_BURST', 2000))
+        self.max_flags_per_request = int(os.getenv('SUBMIT_MAX_FLAGS_PER_REQUEST', 1000))
+        self.buckets = {}  # {team_id: (request bucket, flag bucket)}
+        self.rejections = {}  # {team_id: {reason: count}}
+        self.lock = threading.Lock()
+
+    def _buckets(self, team_id):
+        buckets = self.buckets.get(team_id)
+        if buckets is None:
+            buckets = (TokenBucket(self.requests_per_second, self.request_burst),
+                       TokenBucket(self.flags_per_second, self.flag_burst))
+            self.buckets[team_id] = buckets
+        return buckets
+
+    # Returns None if allowed, otherwise (reason, retry_after seconds)
+    # count_request=False only charges flags, for chunks of an already admitted bulk request
+    def check(self, team_id, num_flags, count_request=True):
+        now = time.monotonic()
+        with self.lock:
+            if count_request and self.max_flags_per_request and num_flags > self.max_flags_per_request:
+                return self._reject(team_id, 'too_many_flags', 0)
+            if self.flags_per_second and num_flags > self.flag_burst:
+                # Could never be satisfied by the flag bucket
+                return self._reject(team_id, 'too_many_flags', 0)
+            request_bucket, flag_bucket = self._buckets(team_id)
+            if count_request and self.requests_per_second:
+                wait = request_bucket.take(1, now)
+                if wait:
+                    return self._reject(team_id, 'requests', wait)
+            if self.flags_per_second and num_flags:
+                wait = flag_bucket.take(num_flags, now)
+                if wait:
+                    return self._reject(team_id, 'flags', wait)
+        return None
+
+    def _reject(self, team_id, reason, retry_after):
+        counts = self.rejections.setdefault(team_id, {})
+        counts[reason] = counts.get(reason, 0) + 1
+        return reason, retry_after
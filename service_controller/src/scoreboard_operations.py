@@ -1,6 +1,19 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
+from collections import OrderedDict, namedtuple
+import gzip
+import hashlib
+import json
+import math
+import queue
 import threading
+import time
 from database_operations import DatabaseOperations
+from flag_codec import FlagCodec
+from flag_index import FlagIndex
+from metrics import SUBMIT_REJECTED, SUBMIT_SECONDS, SUBMITTED_FLAGS
+import metrics
+import tracing
+from rate_limiter import RateLimiter
 from contextlib import contextmanager
 import os
 
@@ -8,27 +21,348 @@ app = Flask(__name__,
     template_folder=os.path.join(os.path.dirname(__file__), 'templates'),
     static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
+# Per-flag submission verdicts
+VERDICT_ACCEPTED = 'accepted'
+VERDICT_DUPLICATE = 'duplicate'
+VERDICT_OWN = 'own'
+VERDICT_EXPIRED = 'expired'
+VERDICT_INVALID = 'invalid'
+VERDICT_THROTTLED = 'throttled'
+
+# Pre-serialized scoreboard, replaced as a whole whenever it is rebuilt
+ScoreboardSnapshot = namedtuple('ScoreboardSnapshot', ['version', 'etag', 'body', 'gzipped', 'data', 'digests'])
+
+# Fans out pre-formatted server-sent events to every connected scoreboard
+class EventBroadcaster:
+    def __init__(self, max_subscribers):
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    # Returns a queue of messages, None when the subscriber limit is reached
+    def subscribe(self):
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            subscriber = queue.Queue(maxsize=16)
+            self.subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Slow client, it refetches the whole scoreboard on its next event anyway
+                pass
+
 class ScoreboardOperations:
-    def __init__(self,db):
+    def __init__(self, db, serve=True):
         self.db = db
         self.current_tick = 1 
-        self.submitted_flags = {}  # {tick: {flag: set(team_ids)}}
+        # Filter of (team, flag) pairs already in the captures ledger, only for flags still valid.
+        # Holds hashes instead of the flags, a hit answers a duplicate without touching the database
+        self.captured = {}  # {flag tick: set(hash((team_id, flag)))}
         self.flag_lock = threading.Lock()  # Lock for thread-safe operations
-        self.api_thread = threading.Thread(target=self._run_api)
-        self.api_thread.daemon = True
-        self.api_thread.start()
+        # Per-team submission limits, per API process
+        self.rate_limiter = RateLimiter()
+        # Teams are fixed by setup, unknown ids are rejected before any per-team state is created
+        self.team_ids = frozenset(self.db.get_team_ids())
+        # API_MODE=standalone serves the API from separate worker processes (see wsgi.py),
+        # tick and submission state are then shared through the database
+        self.shared = os.getenv('API_MODE', 'embedded') == 'standalone'
+        # True in API workers, which follow the controller instead of publishing state
+        self.following = False
+        # Flags planted in the last FLAG_VALIDITY_TICKS ticks, filled by the service controller
+        self.flag_index = FlagIndex(int(os.getenv('FLAG_VALIDITY_TICKS', 1)),
+                                    int(os.getenv('FLAG_EXPIRED_TICKS', 1)))
+        self.last_flag_rowid = 0
+        # FLAG_FORMAT=hmac switches to signed flags validated without any lookup
+        self.flag_codec = None
+        if os.getenv('FLAG_FORMAT', 'random') == 'hmac':
+            secret = os.getenv('FLAG_SECRET')
+            if not secret:
+                if self.shared:
+                    raise ValueError("FLAG_SECRET must be set when API_MODE=standalone")
+                print("Warning: FLAG_SECRET not set, flags will not survive a restart")
+                secret = os.urandom(32)
+            self.flag_codec = FlagCodec(secret, self.db.get_services())
+        # Scoreboard is rebuilt at most once per state change, not per request
+        # Versions continue across restarts, browsers keep theirs and ask for deltas since it
+        state = self.db.get_state()
+        self.version = int(state.get('scoreboard_version', 1))
+        if serve:
+            # Changes committed just before a crash may not have bumped the version, start from a new one
+            self.version += 1
+            self.db.set_state(scoreboard_version=self.version)
+        self.snapshot = None
+        self.snapshot_lock = threading.Lock()
+        self.gzip_enabled = os.getenv('SCOREBOARD_GZIP', '1') == '1'
+        # Per-team digests of recent snapshots, /scoreboard?since=<version> diffs against them
+        self.delta_versions = int(os.getenv('SCOREBOARD_DELTA_VERSIONS', 64))
+        self.digests = OrderedDict()  # {version: {team_id: digest}}
+        self.deltas = (None, {})  # (snapshot version, {since: body}), shared by clients on the same version
+        # Live scoreboard clients connected to /scoreboard/stream
+        max_subscribers = int(os.getenv('SSE_MAX_SUBSCRIBERS', 500))
+        if self.shared:
+            # Each stream holds one of the worker's gthread threads while connected, keep
+            # API_RESERVED_THREADS of them, between a quarter and half, for submissions and scoreboard requests
+            threads = int(os.getenv('API_THREADS', 64))
+            reserved = max(min(int(os.getenv('API_RESERVED_THREADS', 16)), threads // 2), math.ceil(threads / 4))
+            max_subscribers = min(max_subscribers, max(0, threads - reserved))
+        self.events = EventBroadcaster(max_subscribers)
+        self.db.add_listener(self.on_db_change)
+        # Pick up where a restarted controller left off
+        self.current_tick = int(state.get('current_tick', 1))
+        self.load_captures()
+        # In standalone mode the controller leaves serving to the API workers
+        if serve and not self.shared:
+            self.api_thread = threading.Thread(target=self._run_api)
+            self.api_thread.daemon = True
+            self.api_thread.start()
 
     def _run_api(self):
         # ScoreboardOperations instance available to Flask
         app.scoreboard = self
-        app.run(host='0.0.0.0', port=9090)
+        app.run(host='0.0.0.0', port=int(os.getenv('API_PORT', 9090)), threaded=True)
 
 
     def set_tick(self, tick):
+        self._apply_tick(tick)
+        # Always published, API workers follow it and a restarted controller resumes from it
+        self.db.set_state(current_tick=tick)
+        self.invalidate('tick')
+
+    def _apply_tick(self, tick):
         with self.flag_lock:
             if tick != self.current_tick:
-                self.submitted_flags = {}
+                # Captures only need to be filtered while their flags are valid, the ledger keeps the rest
+                for flag_tick in list(self.captured):
+                    if not self.flag_index.is_valid(flag_tick, tick):
+                        del self.captured[flag_tick]
             self.current_tick = tick
+        self.flag_index.expire(tick)
+
+    # Warm the filter and flag index from the database, so a restart forgets neither
+    def load_captures(self):
+        min_tick = self.flag_index.oldest_tick(self.current_tick)
+        with self.flag_lock:
+            for row in self.db.get_captures_since(min_tick):
+                self.captured.setdefault(row['flag_tick'], set()).add(hash((row['team_id'], row['flag'])))
+        if self.flag_codec is None:
+            self._sync_flags()
+
+    # API worker side of standalone mode, follows the state published by the controller
+    def start_state_sync(self):
+        self.following = True
+        interval = float(os.getenv('STATE_POLL_INTERVAL', 0.5))
+        sync_thread = threading.Thread(target=self._sync_state, args=(interval,))
+        sync_thread.daemon = True
+        sync_thread.start()
+
+    def _sync_state(self, interval):
+        while True:
+            try:
+                state = self.db.get_state()
+                tick = int(state.get('current_tick', self.current_tick))
+                if tick != self.current_tick:
+                    tracing.tracer.begin_tick(tick)
+                    self._apply_tick(tick)
+                if self.flag_codec is None:
+                    self._sync_flags()
+                version = int(state.get('scoreboard_version', self.version))
+                if version != self.version:
+                    self.invalidate(state.get('scoreboard_event', 'score'), version)
+            except Exception as e:
+                print(f"Unable to sync shared state: {e}")
+            time.sleep(interval)
+
+    # Load flags committed since the last sync into the local index
+    def _sync_flags(self):
+        min_round = self.flag_index.oldest_tick(self.current_tick)
+        for row in self.db.get_flags_since(self.last_flag_rowid, min_round):
+            self.flag_index.add(row['flag'], row['team_id'], row['service_name'], row['round_id'])
+            self.last_flag_rowid = row['rowid']
+
+    # Judge a batch of submitted flags, returns one verdict per flag
+    def judge_flags(self, team_id, flags):
+        current_tick = self.current_tick
+        verdicts = []
+        captured = []
+        for flag in flags:
+            entry = self.lookup_flag(flag) if isinstance(flag, str) else None
+            if entry is None:
+                verdicts.append(VERDICT_INVALID)
+                continue
+            owner, service_name, flag_tick = entry
+            if owner == team_id:
+                verdicts.append(VERDICT_OWN)
+            elif flag_tick > current_tick:
+                verdicts.append(VERDICT_INVALID)
+            elif not self.flag_index.is_valid(flag_tick, current_tick):
+                verdicts.append(VERDICT_EXPIRED)
+            else:
+                verdicts.append(None)
+                captured.append((flag, flag_tick))
+
+        accepted = iter(self.record_captures(team_id, captured))
+        verdicts = [verdict or (VERDICT_ACCEPTED if next(accepted) else VERDICT_DUPLICATE) for verdict in verdicts]
+        counts = {}
+        for verdict in verdicts:
+            counts[verdict] = counts.get(verdict, 0) + 1
+        for verdict, count in counts.items():
+            SUBMITTED_FLAGS.inc(verdict, amount=count)
+        return verdicts
+
+    # Record captures in the ledger, returns for each whether it wasn't already submitted by this team
+    def record_captures(self, team_id, captured):
+        # Known duplicates are answered by the filter, the rest go to the ledger in one batch
+        with self.flag_lock:
+            unknown = [(flag, flag_tick) for flag, flag_tick in captured
+                       if hash((team_id, flag)) not in self.captured.get(flag_tick, ())]
+        new_flags = self.db.add_captures(team_id, unknown, self.current_tick) if unknown else set()
+
+        with self.flag_lock:
+            for flag, flag_tick in unknown:
+                if self.flag_index.is_valid(flag_tick, self.current_tick):
+                    self.captured.setdefault(flag_tick, set()).add(hash((team_id, flag)))
+
+        # A flag repeated within one request is only accepted once
+        accepted = []
+        for flag, flag_tick in captured:
+            accepted.append(flag in new_flags)
+            new_flags.discard(flag)
+        return accepted
+
+    # Returns (team_id, service_name, tick) of a flag we planted, None otherwise
+    def lookup_flag(self, flag):
+        if self.flag_codec is not None:
+            return self.flag_codec.decode(flag)
+        return self.flag_index.lookup(flag)
+
+    # Called by DatabaseOperations after statuses or scores are committed
+    def on_db_change(self, event):
+        self.invalidate(event)
+
+    def invalidate(self, event, version=None):
+        with self.snapshot_lock:
+            self.version = version if version is not None else self.version + 1
+            version = self.version
+        if not self.following:
+            # Controller side, lets API workers know the scoreboard changed and survives restarts
+            self.db.set_state(scoreboard_version=version, scoreboard_event=event)
+        self.events.publish(event, {'version': version, 'current_tick': self.current_tick})
+
+    def get_snapshot(self):
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+
+        with self.snapshot_lock:
+            if self.snapshot is not None and self.snapshot.version == self.version:
+                return self.snapshot
+            version = self.version
+
+        # Built outside the lock, a change during the build bumps the version again
+        data = self.build_scoreboard()
+        data['version'] = version
+        body = json.dumps(data, sort_keys=True).encode()
+        snapshot = ScoreboardSnapshot(
+            version=version,
+            etag=hashlib.sha1(body).hexdigest(),
+            body=body,
+            gzipped=gzip.compress(body),
+            data=data,
+            # last_updated is left out, it changes for every team on every tick
+            digests={team['team_id']: (team['rank'], team['team_name'], team['score'],
+                                       tuple((name, service['status']) for name, service in sorted(team['services'].items())))
+                     for team in data['teams']}
+        )
+        with self.snapshot_lock:
+            if self.snapshot is None or self.snapshot.version < version:
+                self.snapshot = snapshot
+                self.digests[version] = snapshot.digests
+                while len(self.digests) > self.delta_versions:
+                    self.digests.popitem(last=False)
+        return snapshot
+
+    # Teams whose rank, score or service statuses changed since an earlier snapshot version,
+    # None when that version is no longer remembered and the full scoreboard has to be sent
+    def get_delta(self, since):
+        snapshot = self.get_snapshot()
+        with self.snapshot_lock:
+            old = self.digests.get(since)
+            version, cached = self.deltas
+            if version != snapshot.version:
+                cached = {}
+                self.deltas = (snapshot.version, cached)
+            body = cached.get(since)
+        if old is None or body is not None:
+            return body
+
+        new = snapshot.digests
+        body = json.dumps({
+            'delta': True,
+            'since': since,
+            'version': snapshot.version,
+            'current_tick': snapshot.data['current_tick'],
+            'services': snapshot.data['services'],
+            'team_count': len(new),
+            'teams': [team for team in snapshot.data['teams'] if old.get(team['team_id']) != new[team['team_id']]],
+            'removed': [team_id for team_id in old if team_id not in new]
+        }, sort_keys=True).encode()
+        with self.snapshot_lock:
+            cached[since] = body
+        return body
+
+    # Fetch teams with their service statuses in a single query
+    def build_scoreboard(self):
+        with self.db.get_db(readonly=True) as conn:
+            c = conn.cursor()
+
+            c.execute('SELECT name FROM services')
+            services = [row['name'] for row in c.fetchall()]
+
+            c.execute('''
+                SELECT t.id, t.name, t.score, s.service_name, s.status, s.last_updated
+                FROM teams t
+                LEFT JOIN current_status s ON s.team_id = t.id
+                ORDER BY t.score DESC, t.id
+            ''')
+
+            scoreboard_data = []
+            teams = {}
+            for row in c.fetchall():
+                team_data = teams.get(row['id'])
+                if team_data is None:
+                    team_data = {
+                        'rank': len(scoreboard_data) + 1,
+                        'team_id': row['id'],
+                        'team_name': row['name'],
+                        'score': row['score'],
+                        'services': {}
+                    }
+                    teams[row['id']] = team_data
+                    scoreboard_data.append(team_data)
+
+                if row['service_name'] is not None:
+                    team_data['services'][row['service_name']] = {
+                        'status': row['status'],
+                        'last_updated': row['last_updated']
+                    }
+
+        return {
+            'current_tick': self.current_tick,
+            'teams': scoreboard_data,
+            'services': services
+        }
 
 @app.route('/submit_flags', methods=['POST'])
 def submit_flags():
@@ -38,44 +372,31 @@ def submit_flags():
             return jsonify({'error': 'Missing required fields'}), 400
 
         flags = data['flags']
-        team_id = data['team_id']
+        try:
+            team_id = int(data['team_id'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid team_id'}), 400
+        if team_id not in app.scoreboard.team_ids:
+            return jsonify({'error': 'Unknown team_id'}), 400
         current_tick = app.scoreboard.current_tick
         
         if not isinstance(flags, list):
             return jsonify({'error': 'Flags must be provided as an array'}), 400
 
-        valid_flags = 0
-        with app.scoreboard.flag_lock:
-            if current_tick not in app.scoreboard.submitted_flags:
-                app.scoreboard.submitted_flags[current_tick] = {}
+        # Enforced before any flag is looked at
+        throttled = app.scoreboard.rate_limiter.check(team_id, len(flags))
+        if throttled:
+            reason, retry_after = throttled
+            SUBMIT_REJECTED.inc(reason)
+            if reason == 'too_many_flags':
+                return jsonify({'error': 'Too many flags in one request'}), 413
+            response = jsonify({'error': 'Rate limit exceeded', 'reason': reason})
+            response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+            return response, 429
 
-        with app.scoreboard.db.get_db() as conn:
-            c = conn.cursor()
-            
-            # Check if flag exists and matches the current round and same team for now(changed)
-            for flag in flags:
-                with app.scoreboard.flag_lock:
-                    if (flag in app.scoreboard.submitted_flags[current_tick] and 
-                        team_id in app.scoreboard.submitted_flags[current_tick][flag]):
-                        continue
-
-                    c.execute('''
-                        SELECT * FROM current_flags 
-                        WHERE flag = ? AND round_id = ? AND team_id != ?
-                    ''', (flag, current_tick, team_id))
-                    
-                    result = c.fetchone()
-                    if result:
-                        # Ensure multiple submissions of flag from same team is not accepted
-                        if flag not in app.scoreboard.submitted_flags[current_tick]:
-                            app.scoreboard.submitted_flags[current_tick][flag] = set()
-                        app.scoreboard.submitted_flags[current_tick][flag].add(team_id)
-                        valid_flags += 1
-            
-            # Add attack points instead of directly updating score
-            if valid_flags > 0:
-                app.scoreboard.db.add_attack_points(team_id, valid_flags)
-            conn.commit()
+        # Validate without database reads, flags of other teams still within the validity window
+        verdicts = app.scoreboard.judge_flags(team_id, flags)
+        valid_flags = verdicts.count(VERDICT_ACCEPTED)
 
         return jsonify({
             'success': True,
@@ -88,55 +409,245 @@ def submit_flags():
         return jsonify({'error': str(e)}), 500
 
 
+# Submission latency, teardown runs after a streamed response has been sent
+TIMED_ENDPOINTS = {'submit_flags', 'submit_flags_stream'}
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.trace_start = time.time()
+
+
+@app.teardown_request
+def observe_request_time(error=None):
+    if request.endpoint in TIMED_ENDPOINTS and 'request_start' in g:
+        SUBMIT_SECONDS.observe(time.perf_counter() - g.request_start, request.endpoint)
+    if tracing.tracer.active and 'trace_start' in g:
+        tracing.tracer.complete(f'{request.method} {request.path}', 'api', g.trace_start,
+                                {'endpoint': request.endpoint, 'error': str(error) if error else None})
+
+
+# Reads one flag per line, either raw or as NDJSON ("flag{...}" or {"flag": "flag{...}"})
+def parse_flag_line(line):
+    line = line.decode(errors='replace').strip() if isinstance(line, bytes) else line.strip()
+    if not line:
+        return None
+    if line[0] in '"{':
+        try:
+            value = json.loads(line)
+        except ValueError:
+            return line
+        if isinstance(value, dict):
+            value = value.get('flag')
+        return value
+    return line
+
+
+# Bulk submission, body is streamed and judged in chunks, verdicts are streamed back as NDJSON
+@app.route('/submit_flags/stream', methods=['POST'])
+def submit_flags_stream():
+    try:
+        team_id = int(request.args.get('team_id', request.headers.get('X-Team-Id')))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Missing or invalid team_id'}), 400
+    if team_id not in app.scoreboard.team_ids:
+        return jsonify({'error': 'Unknown team_id'}), 400
+
+    throttled = app.scoreboard.rate_limiter.check(team_id, 0)
+    if throttled:
+        SUBMIT_REJECTED.inc(throttled[0])
+        response = jsonify({'error': 'Rate limit exceeded', 'reason': throttled[0]})
+        response.headers['Retry-After'] = str(max(1, math.ceil(throttled[1])))
+        return response, 429
+
+    chunk_size = int(os.getenv('BULK_CHUNK_SIZE', 500))
+    limiter = app.scoreboard.rate_limiter
+    if limiter.flags_per_second:
+        # A chunk larger than the flag burst could never be admitted
+        chunk_size = max(1, min(chunk_size, int(limiter.flag_burst)))
+    # Longest accepted line, longer ones are judged invalid without being buffered
+    max_line = int(os.getenv('BULK_MAX_LINE', 1024))
+    body = request.stream
+
+    # chunk holds (line number, flag) pairs
+    def judge_chunk(chunk):
+        flags = [flag for _, flag in chunk]
+        if app.scoreboard.rate_limiter.check(team_id, len(flags), count_request=False):
+            verdicts = [VERDICT_THROTTLED] * len(flags)
+            SUBMITTED_FLAGS.inc(VERDICT_THROTTLED, amount=len(flags))
+        else:
+            verdicts = app.scoreboard.judge_flags(team_id, flags)
+        lines = []
+        for (number, flag), verdict in zip(chunk, verdicts):
+            summary[verdict] = summary.get(verdict, 0) + 1
+            lines.append(json.dumps({'line': number, 'flag': flag, 'verdict': verdict}) + '\n')
+        return ''.join(lines)
+
+    summary = {}
+
+    # Lines of the body, each read with a bounded readline
+    def lines():
+        while True:
+            line = body.readline(max_line + 1)
+            if not line:
+                return
+            if len(line) > max_line and not line.endswith(b'\n'):
+                # Skip the rest of the over-long line, a piece at a time
+                while line and not line.endswith(b'\n'):
+                    line = body.readline(max_line + 1)
+                yield None
+                continue
+            yield line
+
+    # Verdicts come back in input order, each with the number of the line it judges
+    def stream():
+        chunk = []
+        for number, line in enumerate(lines(), 1):
+            if line is None:
+                if chunk:
+                    yield judge_chunk(chunk)
+                    chunk = []
+                summary[VERDICT_INVALID] = summary.get(VERDICT_INVALID, 0) + 1
+                SUBMITTED_FLAGS.inc(VERDICT_INVALID)
+                yield json.dumps({'line': number, 'flag': None, 'verdict': VERDICT_INVALID, 'error': 'Line too long'}) + '\n'
+                continue
+            flag = parse_flag_line(line)
+            if flag is None:
+                continue
+            chunk.append((number, flag))
+            if len(chunk) >= chunk_size:
+                yield judge_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield judge_chunk(chunk)
+        yield json.dumps({'summary': summary, 'current_tick': app.scoreboard.current_tick}) + '\n'
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+
+# Score and status time series in a columnar layout:
+# {"ticks": [...], "teams": [...], "score": [[per tick] per team], ..., "status": {service: [[code per tick] per team]}}
+@app.route('/history', methods=['GET'])
+def get_history():
+    try:
+        max_points = int(os.getenv('HISTORY_MAX_POINTS', 500))
+        last_tick = int(request.args.get('to', app.scoreboard.current_tick))
+        first_tick = int(request.args.get('from', max(1, last_tick - max_points + 1)))
+        step = int(request.args.get('step', 1))
+        team_ids = [int(team_id) for team_id in request.args.get('teams', '').split(',') if team_id]
+    except ValueError:
+        return jsonify({'error': 'from, to, step and teams must be integers'}), 400
+    if first_tick > last_tick or step < 1:
+        return jsonify({'error': 'Invalid tick range'}), 400
+
+    try:
+        # Downsample long ranges so a response never holds more than max_points ticks
+        step = max(step, math.ceil((last_tick - first_tick + 1) / max_points))
+        scores, statuses = app.scoreboard.db.get_history(first_tick, last_tick, step, team_ids)
+
+        ticks = sorted({row['tick'] for row in scores} | {row['tick'] for row in statuses})
+        teams = sorted({row['team_id'] for row in scores} | {row['team_id'] for row in statuses})
+        tick_index = {tick: i for i, tick in enumerate(ticks)}
+        team_index = {team_id: i for i, team_id in enumerate(teams)}
+
+        def empty_series():
+            return [[None] * len(ticks) for _ in teams]
+
+        series = {name: empty_series() for name in ('score', 'delta', 'sla_points', 'attack_points')}
+        for row in scores:
+            for name in series:
+                series[name][team_index[row['team_id']]][tick_index[row['tick']]] = row[name]
+
+        # Statuses are sent as indexes into status_codes
+        status_codes = []
+        status_series = {}
+        for row in statuses:
+            if row['status'] not in status_codes:
+                status_codes.append(row['status'])
+            service_series = status_series.setdefault(row['service_name'], empty_series())
+            service_series[team_index[row['team_id']]][tick_index[row['tick']]] = status_codes.index(row['status'])
+
+        return jsonify({
+            'from': first_tick,
+            'to': last_tick,
+            'step': step,
+            'ticks': ticks,
+            'teams': teams,
+            **series,
+            'status_codes': status_codes,
+            'status': status_series
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Prometheus metrics of this process
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# Rejected submissions per team and reason
+@app.route('/rate_limits', methods=['GET'])
+def get_rate_limits():
+    rejections = app.scoreboard.rate_limiter.rejections
+    return jsonify({str(team_id): dict(counts) for team_id, counts in list(rejections.items())})
+
+
 @app.route('/scoreboard', methods=['GET'])
 def get_scoreboard():
     try:
-        with app.scoreboard.db.get_db() as conn:
-            c = conn.cursor()
-            
-            c.execute('''
-                SELECT id, name, score 
-                FROM teams 
-                ORDER BY score DESC
-            ''')
-            teams = [dict(row) for row in c.fetchall()]
-            
-            c.execute('SELECT name FROM services')
-            services = [dict(row)['name'] for row in c.fetchall()]
-            
-            scoreboard_data = []
-            for team in teams:
-                team_data = {
-                    'team_id': team['id'],
-                    'team_name': team['name'],
-                    'score': team['score'],
-                    'services': {}
-                }
-                
-                c.execute('''
-                    SELECT service_name, status, last_updated 
-                    FROM current_status 
-                    WHERE team_id = ?
-                ''', (team['id'],))
-                
-                service_statuses = c.fetchall()
-                for service in service_statuses:
-                    team_data['services'][service['service_name']] = {
-                        'status': service['status'],
-                        'last_updated': service['last_updated']
-                    }
-                
-                scoreboard_data.append(team_data)
-            
-            return jsonify({
-                'current_tick': app.scoreboard.current_tick,
-                'teams': scoreboard_data,
-                'services': services
-            })
+        # ?since=<version> returns only the teams that changed, or the full scoreboard
+        # when that version is too old
+        since = request.args.get('since', type=int)
+        if since is not None:
+            body = app.scoreboard.get_delta(since)
+            if body is not None:
+                response = Response(body, mimetype='application/json')
+                response.headers['Cache-Control'] = 'no-cache'
+                return response
+
+        snapshot = app.scoreboard.get_snapshot()
+        if snapshot.etag in request.if_none_match:
+            response = Response(status=304)
+        elif app.scoreboard.gzip_enabled and request.accept_encodings['gzip']:
+            response = Response(snapshot.gzipped, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(snapshot.body, mimetype='application/json')
+        response.set_etag(snapshot.etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/scoreboard/stream', methods=['GET'])
+def scoreboard_stream():
+    subscriber = app.scoreboard.events.subscribe()
+    if subscriber is None:
+        return jsonify({'error': 'Too many live scoreboard clients'}), 503
+
+    def stream():
+        try:
+            yield f"retry: 5000\nevent: hello\ndata: {json.dumps({'version': app.scoreboard.version})}\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=15)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+        finally:
+            app.scoreboard.events.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/')
 def index():
     return render_template('scoreboard.html')
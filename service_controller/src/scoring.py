@@ -0,0 +1,84 @@
+import argparse
+import json
+import time
+
+# Points for a service being UP for a tick and for each captured flag
+SLA_POINTS = 10
+ATTACK_POINTS = 10
+
+
+# Round score formula, also registered as the round_score() SQL function so
+# live scoring and replays always agree. Change it here and run a replay to rescore a game.
+def round_score(sla, attack):
+    return sla * (1 + attack)
+
+
+def register_functions(conn, formula=round_score):
+    conn.create_function('round_score', 2, formula, deterministic=True)
+
+
+# Recompute every team's score from the event log of sealed rounds. The log is read and the
+# scores rewritten in one write transaction so a round sealed meanwhile can't be overwritten
+def replay(db, formula=round_score, dry_run=False):
+    if dry_run:
+        with db.get_db(readonly=True) as conn:
+            return _rescore(conn.cursor(), formula)[:2]
+
+    with db.get_db() as conn:
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        totals, last_tick, history = _rescore(c, formula)
+        c.execute('DELETE FROM score_history')
+        c.executemany('''INSERT INTO score_history (tick, team_id, sla_points, attack_points, delta, score)
+                       VALUES (?, ?, ?, ?, ?, ?)''', history)
+        c.executemany('UPDATE teams SET score = ? WHERE id = ?',
+                      [(score, team_id) for team_id, score in totals.items()])
+    db.notify('score')
+    return totals, last_tick
+
+
+def _rescore(c, formula):
+    c.execute('SELECT id FROM teams ORDER BY id')
+    teams = [row['id'] for row in c.fetchall()]
+    c.execute('''SELECT tick, team_id,
+                      SUM(CASE WHEN kind = 'sla' THEN points ELSE 0 END) AS sla_points,
+                      SUM(CASE WHEN kind = 'attack' THEN points ELSE 0 END) AS attack_points
+               FROM score_events
+               WHERE tick IS NOT NULL
+               GROUP BY tick, team_id''')
+    points = {(row['tick'], row['team_id']): (row['sla_points'], row['attack_points']) for row in c.fetchall()}
+    c.execute('SELECT MAX(tick) AS tick FROM score_history')
+    last_tick = max([row['tick'] for row in c.fetchall() if row['tick'] is not None] +
+                    [tick for tick, _ in points], default=0)
+
+    # One in-memory pass over all ticks, teams without events score formula(0, 0)
+    totals = {team_id: 0 for team_id in teams}
+    history = []
+    for tick in range(1, last_tick + 1):
+        for team_id in teams:
+            sla, attack = points.get((tick, team_id), (0, 0))
+            delta = formula(sla, attack)
+            totals[team_id] += delta
+            history.append((tick, team_id, sla, attack, delta, totals[team_id]))
+    return totals, last_tick, history
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rescore a game from its event log")
+    parser.add_argument('command', choices=['replay'])
+    parser.add_argument('--db', default='database/ctf.db', help="SQLite database path")
+    parser.add_argument('--formula', help="Python expression over sla and attack, e.g. 'sla * (1 + attack)'")
+    parser.add_argument('--dry-run', action='store_true', help="Print the new scores without writing them")
+    args = parser.parse_args()
+
+    from database_operations import DatabaseOperations
+
+    formula = round_score
+    if args.formula:
+        expression = compile(args.formula, '<formula>', 'eval')
+        formula = lambda sla, attack: eval(expression, {'__builtins__': {}}, {'sla': sla, 'attack': attack})
+
+    start = time.time()
+    totals, last_tick = replay(DatabaseOperations(args.db), formula, args.dry_run)
+    print(json.dumps({str(team_id): score for team_id, score in totals.items()}, indent=2))
+    print(f"[*] Replayed {last_tick} ticks for {len(totals)} teams in {time.time() - start:.2f}s")
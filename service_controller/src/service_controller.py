@@ -1,9 +1,16 @@
+import asyncio
 import os
-import subprocess
-import threading
 import time
+import metrics
+import tracing
+from agent_dispatcher import AgentDispatcher
+from checker_operations import CheckerOperations
+from circuit_breaker import CircuitBreaker
 from database_operations import DatabaseOperations
+from database_writer import DatabaseWriter
+from flag_archiver import FlagArchiver
 from scoreboard_operations import ScoreboardOperations
+from tick_engine import TickEngine
 
 def gen_flag():
     return "flag{" + os.urandom(32).hex() + "}"
@@ -11,69 +18,131 @@ def gen_flag():
 class ServiceController:
     def __init__(self):
         self.db = DatabaseOperations()
+        # Single writer thread batching per-tick flags, statuses and SLA points
+        self.writer = DatabaseWriter(self.db)
         self.scoreboard = ScoreboardOperations(self.db)
+        # Keeps only the flags of the retention window in current_flags
+        self.archiver = FlagArchiver(self.db, lambda: self.scoreboard.flag_index.oldest_tick(self.scoreboard.current_tick))
+        self.checkers = CheckerOperations(os.getenv('CHECKER_DIR', 'checkers'))
+        # Dead services are probed with a TCP connect instead of waiting out the checker timeouts
+        self.breaker = CircuitBreaker(self.db.get_service_ports(), self.checkers.http.hosts)
+        # "local" runs checkers on this node, "agents" hands them to checker_agent.py workers
+        self.execution_mode = os.getenv('EXECUTION_MODE', 'local')
+        if self.execution_mode == 'agents':
+            self.agents = AgentDispatcher()
+            self.agents.start()
+            self.engine = TickEngine(self.dispatch_team_service, self.record_result, breaker=self.breaker)
+        else:
+            self.engine = TickEngine(self.check_team_service, self.record_result, breaker=self.breaker)
         # Default to 3 minutes
         self.tick_interval = int(os.getenv('TICK_INTERVAL', 180))  
         # Default to 2 teams
         self.num_teams = int(os.getenv('NUM_TEAMS', 2))  
+        # Seconds kept free at the end of a tick for committing results and scoring
+        self.scoring_reserve = min(float(os.getenv('TICK_SCORING_RESERVE', 1)), self.tick_interval / 4)
+        # API workers only see their own metrics, tick and checker metrics are served from here
+        if self.scoreboard.shared:
+            metrics.start_server(int(os.getenv('METRICS_PORT', 9091)))
 
     def run_healthchecks(self, services):
-        checker_dir = 'checkers'
+        asyncio.run(self._run_healthchecks(services))
+
+    async def _run_healthchecks(self, services):
+        timeouts = self.db.get_service_timeouts()
+        # A restarted controller continues after the last tick it started, RESUME_TICK=0 starts over
         tick = 1
+        if os.getenv('RESUME_TICK', '1') == '1':
+            tick = int(self.db.get_state().get('current_tick', 0)) + 1
+        # Ticks start on fixed boundaries so slow checks don't make the game drift
+        tick_start = time.time()
         while True:
-            print(f"\n--- Tick {tick} ---")
-            # Update tick in scoreboard
+            deadline = tick_start + self.tick_interval
+            await self.run_tick(services, tick, timeouts, deadline)
+            tick += 1
+
+            slack = deadline - time.time()
+            print(f"[*] Tick #{tick - 1} finished with {slack:.2f}s slack", flush=True)
+            tick_start = deadline
+            if slack < 0:
+                # Overran into the next tick, skip to the next boundary instead of bursting
+                missed = int(-slack // self.tick_interval) + 1
+                print(f"Warning: Tick #{tick - 1} overran by {-slack:.2f}s, skipping {missed} boundary(s)")
+                tick_start += missed * self.tick_interval
+            await asyncio.sleep(max(0, tick_start - time.time()))
+
+    # Plant flags, check every team and score the round, returns seconds spent checking
+    async def run_tick(self, services, tick, timeouts=None, deadline=None):
+        print(f"\n--- Tick {tick} ---")
+        tracing.tracer.begin_tick(tick)
+        # Update tick in scoreboard
+        with tracing.span('set_tick', 'tick', tick=tick):
             self.scoreboard.set_tick(tick)  
-            start = time.time()
-            for service_name in services:
-                checker = f"{service_name}_checker.py"
-                checker_path = os.path.join(checker_dir, checker)
-
-                # Skip if checker doesn't exist
-                if not os.path.exists(checker_path):
-                    print(f"Warning: Checker not found for service {service_name}")
-                    continue
-
-                print(f"\nChecking {service_name}:")
-                threads = []
-                for team in range(1, self.num_teams + 1):
-                    thread = threading.Thread(
-                        target=self.check_team_service,
-                        args=(service_name, tick, team, checker_path)
-                    )
-                    threads.append(thread)
-                    thread.start()
-                for thread in threads:
-                    thread.join()
-                    
-            end = time.time()
-            print(f"\n\n\n[*] Tick #{tick} took {end-start}s for healthcheck\n\n\n", flush=True)
+        start = time.time()
+
+        # Skip if checker doesn't exist
+        checked_services = []
+        for service_name in services:
+            if not self.checkers.has_checker(service_name):
+                print(f"Warning: Checker not found for service {service_name}")
+                continue
+            checked_services.append(service_name)
+
+        print(f"\nChecking {', '.join(checked_services)}:")
+        with tracing.span('checks', 'tick', services=checked_services, teams=self.num_teams):
+            await self.engine.run_tick(checked_services, tick, range(1, self.num_teams + 1), timeouts,
+                                       deadline - self.scoring_reserve if deadline is not None else None)
 
+        end = time.time()
+        print(f"\n\n\n[*] Tick #{tick} took {end-start}s for healthcheck\n\n\n", flush=True)
+        metrics.TICK_PHASE_SECONDS.observe(end - start, 'check')
+
+        # Make sure every result of this tick is committed before scoring
+        with tracing.span('commit', 'tick'):
+            if not self.writer.flush(timeout=self.tick_interval):
+                print(f"Error: Tick #{tick} is scored with writes missing: {self.writer.last_error}", flush=True)
+        committed = time.time()
+        metrics.TICK_PHASE_SECONDS.observe(committed - end, 'commit')
+        with tracing.span('score', 'tick'):
             self.db.calculate_round_score(tick)
-            tick += 1
-            time.sleep(self.tick_interval)
-
-    # Threaded function to parallelly run healthchecks+flag plant for all teams
-    def check_team_service(self, service_name, tick, team, checker_path):
-        flag = gen_flag()
-        print(f"Team {team} flag: {flag}")
-        self.db.insert_flag(service_name, tick, team, flag)
-        result = self.run_checker(checker_path, team, flag)
-        print(f"Result from team {team} check:", result)
-        self.update_service_status(service_name, result, team)
-
-    # Execute healthcheck script
-    def run_checker(self, checker_path, team, flag):
-        service_name = os.path.basename(checker_path).replace('_checker.py', '')
-        print(f"Running checker script for f{service_name}")
-        result = subprocess.run(['python', checker_path, f'team{team}', flag], capture_output=True, text=True)
-        return result.stdout.strip()
+        metrics.TICK_PHASE_SECONDS.observe(time.time() - committed, 'score')
+        metrics.TICK_PHASE_SECONDS.observe(time.time() - start, 'total')
+        return end - start
+
+    # Runs on the tick engine's worker pool to healthcheck+plant flag for one team
+    def check_team_service(self, service_name, tick, team, timeout=None):
+        with tracing.span('check_team_service', 'checker', service=service_name, team=team, timeout=timeout):
+            flag = self.create_flag(service_name, tick, team)
+            return self.checkers.run(service_name, team, flag, timeout)
+
+    # EXECUTION_MODE=agents, the flag is created here and the check runs on an agent
+    async def dispatch_team_service(self, service_name, tick, team, timeout=None):
+        flag = self.create_flag(service_name, tick, team)
+        return await self.agents.run(service_name, tick, team, flag, timeout)
+
+    # Generate the flag a team's service gets this tick and make it submittable
+    def create_flag(self, service_name, tick, team):
+        with tracing.span('create_flag', 'checker'):
+            if self.scoreboard.flag_codec is not None:
+                # Signed flags carry their owner and tick, nothing to store
+                flag = self.scoreboard.flag_codec.encode(team, service_name, tick)
+                print(f"Team {team} flag: {flag}")
+            else:
+                flag = gen_flag()
+                print(f"Team {team} flag: {flag}")
+                self.scoreboard.flag_index.add(flag, team, service_name, tick)
+                self.writer.insert_flag(service_name, tick, team, flag)
+        return flag
+
+    # Called by the tick engine with the final status of a check
+    def record_result(self, service_name, tick, team, status):
+        print(f"Result from team {team} check:", status)
+        self.update_service_status(service_name, status, team, tick)
 
     # Update database and scoreboard with service status
-    def update_service_status(self, service_name, status, team):
+    def update_service_status(self, service_name, status, team, tick=None):
         print(f"  Team {team}: {status}")
-        self.db.update_service_status(service_name, status, team)
-        self.db.update_service_score(service_name, status, team, self.scoreboard.current_tick)
+        self.writer.update_service_status(service_name, status, team, tick)
+        self.writer.update_service_score(service_name, status, team, self.scoreboard.current_tick)
 
 if __name__ == '__main__':
     controller = ServiceController()
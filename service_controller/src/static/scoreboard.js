@@ -1,8 +1,14 @@
 document.addEventListener('DOMContentLoaded', () => {
     lucide.createIcons();
     
+    const tbody = document.getElementById('scoreboard-body');
+    // Rendered rows by team id, only rows whose data changed are touched on refresh
+    const rows = new Map();
+    let version = null;
+
     function updateScoreboard() {
-        fetch('/scoreboard')
+        const url = version === null ? '/scoreboard' : `/scoreboard?since=${version}`;
+        fetch(url)
             .then(response => response.json())
             .then(data => {
                 // Update tick counter with animation
@@ -17,48 +23,23 @@ document.addEventListener('DOMContentLoaded', () => {
                     tickElement.textContent = newTick;
                 }
 
-                const tbody = document.getElementById('scoreboard-body');
-                tbody.innerHTML = '';
-
-                data.teams.forEach((team, index) => {
-                    const tr = document.createElement('tr');
-                    tr.style.animation = `fadeIn 0.5s ease-out ${index * 0.1}s`;
-
-                    // Rank column with icon
-                    const rankIcon = getRankIcon(index);
-                    tr.innerHTML = `
-                        <td>
-                            <div style="display: flex; align-items: center;">
-                                ${rankIcon}
-                                <span>#${index + 1}</span>
-                            </div>
-                        </td>
-                        <td>
-                            <div style="font-weight: 600;">${team.team_name}</div>
-                        </td>
-                        <td>
-                            <div style="display: flex; flex-wrap: wrap; gap: 0.5rem;">
-                                ${Object.entries(team.services).map(([service, data]) => `
-                                    <span class="service-status ${data.status.toLowerCase()}">
-                                        ${getServiceIcon(data.status)}
-                                        ${service}
-                                    </span>
-                                `).join('')}
-                            </div>
-                        </td>
-                        <td>
-                            <div class="score" style="${getScoreStyle(index)}">
-                                ${team.score}
-                            </div>
-                        </td>
-                    `;
-
-                    tbody.appendChild(tr);
+                // A full scoreboard replaces every row, a delta only the listed ones
+                const removed = data.delta ? data.removed : [...rows.keys()].filter(
+                    teamId => !data.teams.some(team => team.team_id === teamId));
+                removed.forEach(teamId => {
+                    rows.get(teamId).tr.remove();
+                    rows.delete(teamId);
                 });
 
+                const changed = new Set();
+                data.teams.forEach(team => updateRow(team, changed));
+                orderRows();
+
+                changed.forEach(element => lucide.createIcons({ icons: lucide.icons, root: element }));
+                version = data.version;
+
                 document.getElementById('last-updated').textContent = new Date().toLocaleTimeString();
                 document.getElementById('error-message').classList.add('hidden');
-                lucide.createIcons();
             })
             .catch(error => {
                 console.error('Error fetching scoreboard:', error);
@@ -68,6 +49,83 @@ document.addEventListener('DOMContentLoaded', () => {
             });
     }
 
+    function createRow(team) {
+        const tr = document.createElement('tr');
+        tr.style.animation = `fadeIn 0.5s ease-out ${Math.min(team.rank - 1, 10) * 0.1}s`;
+        tr.innerHTML = `
+            <td>
+                <div class="rank-cell" style="display: flex; align-items: center;"></div>
+            </td>
+            <td>
+                <div class="team-name" style="font-weight: 600;"></div>
+            </td>
+            <td>
+                <div class="team-services" style="display: flex; flex-wrap: wrap; gap: 0.5rem;"></div>
+            </td>
+            <td>
+                <div class="score"></div>
+            </td>
+        `;
+        const row = {
+            tr,
+            rankCell: tr.querySelector('.rank-cell'),
+            nameCell: tr.querySelector('.team-name'),
+            servicesCell: tr.querySelector('.team-services'),
+            scoreCell: tr.querySelector('.score'),
+            rank: null,
+            score: null,
+            services: new Map()
+        };
+        rows.set(team.team_id, row);
+        return row;
+    }
+
+    // Patch the cells of a team's row that differ from what is rendered
+    function updateRow(team, changed) {
+        const row = rows.get(team.team_id) || createRow(team);
+        const index = team.rank - 1;
+
+        if (row.rank !== team.rank) {
+            row.rankCell.innerHTML = `${getRankIcon(index)}<span>#${team.rank}</span>`;
+            row.scoreCell.style.cssText = getScoreStyle(index);
+            changed.add(row.rankCell);
+            row.rank = team.rank;
+        }
+        if (row.nameCell.textContent !== team.team_name) {
+            row.nameCell.textContent = team.team_name;
+        }
+        if (row.score !== team.score) {
+            row.scoreCell.textContent = team.score;
+            row.score = team.score;
+        }
+
+        Object.entries(team.services).forEach(([service, data]) => {
+            let span = row.services.get(service);
+            if (!span) {
+                span = document.createElement('span');
+                row.servicesCell.appendChild(span);
+                row.services.set(service, span);
+            } else if (span.dataset.status === data.status) {
+                return;
+            }
+            span.dataset.status = data.status;
+            span.className = `service-status ${data.status.toLowerCase()}`;
+            span.innerHTML = `${getServiceIcon(data.status)} ${service}`;
+            changed.add(span);
+        });
+    }
+
+    // Move only the rows that are out of rank order
+    function orderRows() {
+        const sorted = [...rows.values()].sort((a, b) => a.rank - b.rank);
+        sorted.forEach((row, index) => {
+            const current = tbody.children[index];
+            if (current !== row.tr) {
+                tbody.insertBefore(row.tr, current || null);
+            }
+        });
+    }
+
     function getRankIcon(index) {
         switch (index) {
             case 0:
@@ -97,9 +155,48 @@ document.addEventListener('DOMContentLoaded', () => {
         return '';
     }
 
+    let pollTimer = null;
+    let refreshTimer = null;
+
+    // Polling every 30 seconds is only used while the live stream is unavailable
+    function startPolling() {
+        if (!pollTimer) {
+            pollTimer = setInterval(updateScoreboard, 30000);
+        }
+    }
+
+    function stopPolling() {
+        clearInterval(pollTimer);
+        pollTimer = null;
+    }
+
+    // Coalesce bursts of events (e.g. many status updates in one tick) into one fetch
+    function scheduleRefresh() {
+        if (!refreshTimer) {
+            refreshTimer = setTimeout(() => {
+                refreshTimer = null;
+                updateScoreboard();
+            }, 250);
+        }
+    }
+
+    function connectStream() {
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+
+        const source = new EventSource('/scoreboard/stream');
+        ['tick', 'status', 'score'].forEach(event => source.addEventListener(event, scheduleRefresh));
+        source.onopen = () => {
+            stopPolling();
+            scheduleRefresh();
+        };
+        // EventSource reconnects by itself, poll until it does
+        source.onerror = startPolling;
+    }
+
     // Initial update
     updateScoreboard();
-
-    // Update every 30 seconds
-    setInterval(updateScoreboard, 30000);
+    connectStream();
 }); 
\ No newline at end of file
@@ -0,0 +1,135 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import setup_adf
+from database_operations import DatabaseOperations
+from scoring import ATTACK_POINTS
+from scoreboard_operations import (ScoreboardOperations, VERDICT_ACCEPTED, VERDICT_DUPLICATE, VERDICT_EXPIRED,
+                                   VERDICT_INVALID, VERDICT_OWN)
+
+
+# Fresh database per test with the schema from setup_adf.py
+class DatabaseTestCase(unittest.TestCase):
+    env = {'API_MODE': 'embedded', 'FLAG_FORMAT': 'random', 'FLAG_VALIDITY_TICKS': '2', 'FLAG_EXPIRED_TICKS': '1'}
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        patch = mock.patch.dict(os.environ, self.env)
+        patch.start()
+        self.addCleanup(patch.stop)
+        setup_adf.initialize_database(['one', 'two', 'three'], [('web', 5000, 5)])
+        self.db = DatabaseOperations('database/ctf.db')
+
+    def scoreboard(self):
+        return ScoreboardOperations(DatabaseOperations('database/ctf.db'), serve=False)
+
+    def attack_points(self):
+        with self.db.get_db(readonly=True) as conn:
+            return {row['id']: row['attack_points'] for row in conn.execute('SELECT id, attack_points FROM teams')}
+
+    def plant(self, scoreboard, flag, team, tick):
+        self.db.insert_flag('web', tick, team, flag)
+        scoreboard.flag_index.add(flag, team, 'web', tick)
+
+
+class AddCapturesTest(DatabaseTestCase):
+    def test_returns_only_new_flags(self):
+        self.assertEqual(self.db.add_captures(2, [('flag{a}', 1), ('flag{b}', 1)], 1), {'flag{a}', 'flag{b}'})
+        self.assertEqual(self.db.add_captures(2, [('flag{a}', 1), ('flag{c}', 1)], 1), {'flag{c}'})
+        # Unique per attacker, another team can still capture the same flag
+        self.assertEqual(self.db.add_captures(3, [('flag{a}', 1)], 1), {'flag{a}'})
+        self.assertEqual(self.attack_points()[2], 3 * ATTACK_POINTS)
+
+    def test_duplicates_within_one_request(self):
+        self.assertEqual(self.db.add_captures(2, [('flag{a}', 1), ('flag{a}', 1), ('flag{b}', 1)], 1),
+                         {'flag{a}', 'flag{b}'})
+        self.assertEqual(self.attack_points()[2], 2 * ATTACK_POINTS)
+
+    def test_batches_larger_than_one_statement(self):
+        captured = [('flag{%s}' % i, 1) for i in range(2500)]
+        self.assertEqual(len(self.db.add_captures(2, captured, 1)), 2500)
+        self.assertEqual(self.db.add_captures(2, captured, 1), set())
+
+
+class JudgeFlagsTest(DatabaseTestCase):
+    def test_duplicates_in_request_and_across_requests(self):
+        scoreboard = self.scoreboard()
+        scoreboard.set_tick(3)
+        self.plant(scoreboard, 'flag{a}', 1, 3)
+        self.plant(scoreboard, 'flag{b}', 1, 3)
+        self.assertEqual(scoreboard.judge_flags(2, ['flag{a}', 'flag{b}', 'flag{a}']),
+                         [VERDICT_ACCEPTED, VERDICT_ACCEPTED, VERDICT_DUPLICATE])
+        self.assertEqual(scoreboard.judge_flags(2, ['flag{a}']), [VERDICT_DUPLICATE])
+        self.assertEqual(scoreboard.judge_flags(3, ['flag{a}']), [VERDICT_ACCEPTED])
+        self.assertEqual(self.attack_points()[2], 2 * ATTACK_POINTS)
+
+    def test_duplicates_detected_after_restart(self):
+        scoreboard = self.scoreboard()
+        scoreboard.set_tick(3)
+        self.plant(scoreboard, 'flag{a}', 1, 3)
+        self.plant(scoreboard, 'flag{b}', 1, 3)
+        scoreboard.judge_flags(2, ['flag{a}'])
+
+        restarted = self.scoreboard()
+        self.assertEqual(restarted.current_tick, 3)
+        # Flag index and filter are warmed from the database
+        self.assertEqual(restarted.judge_flags(2, ['flag{a}', 'flag{b}']), [VERDICT_DUPLICATE, VERDICT_ACCEPTED])
+        self.assertEqual(self.attack_points()[2], 2 * ATTACK_POINTS)
+
+    def test_ledger_is_checked_when_filter_misses(self):
+        scoreboard = self.scoreboard()
+        scoreboard.set_tick(3)
+        self.plant(scoreboard, 'flag{a}', 1, 3)
+        scoreboard.judge_flags(2, ['flag{a}'])
+        scoreboard.captured.clear()
+        self.assertEqual(scoreboard.judge_flags(2, ['flag{a}']), [VERDICT_DUPLICATE])
+
+    def test_filter_is_trimmed_to_validity_window(self):
+        scoreboard = self.scoreboard()
+        scoreboard.set_tick(3)
+        self.plant(scoreboard, 'flag{a}', 1, 3)
+        scoreboard.judge_flags(2, ['flag{a}'])
+        scoreboard.set_tick(4)
+        self.assertIn(3, scoreboard.captured)
+        scoreboard.set_tick(5)
+        self.assertNotIn(3, scoreboard.captured)
+
+
+class SignedFlagsTest(DatabaseTestCase):
+    env = dict(DatabaseTestCase.env, FLAG_FORMAT='hmac', FLAG_SECRET='test-secret',
+               FLAG_VALIDITY_TICKS='1', FLAG_EXPIRED_TICKS='1')
+
+    def test_verdicts(self):
+        scoreboard = self.scoreboard()
+        scoreboard.set_tick(5)
+        codec = scoreboard.flag_codec
+        current = codec.encode(1, 'web', 5)
+        forged = current[:-2] + ('0' if current[-2] != '0' else '1') + '}'
+        self.assertEqual(scoreboard.judge_flags(2, [current, current, codec.encode(2, 'web', 5),
+                                                    codec.encode(1, 'web', 4), codec.encode(1, 'web', 6), forged]),
+                         [VERDICT_ACCEPTED, VERDICT_DUPLICATE, VERDICT_OWN, VERDICT_EXPIRED, VERDICT_INVALID,
+                          VERDICT_INVALID])
+
+    def test_flags_expire_with_ticks(self):
+        scoreboard = self.scoreboard()
+        scoreboard.set_tick(5)
+        flag = scoreboard.flag_codec.encode(1, 'web', 5)
+        scoreboard.set_tick(6)
+        self.assertEqual(scoreboard.judge_flags(2, [flag]), [VERDICT_EXPIRED])
+
+    def test_other_secret_is_rejected_after_restart(self):
+        flag = self.scoreboard().flag_codec.encode(1, 'web', 1)
+        with mock.patch.dict(os.environ, {'FLAG_SECRET': 'rotated'}):
+            self.assertEqual(self.scoreboard().judge_flags(2, [flag]), [VERDICT_INVALID])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import threading
+import unittest
+from unittest import mock
+
+from database_writer import DatabaseWriter
+from metrics import DB_DROPPED
+from test_captures import DatabaseTestCase
+
+
+class DatabaseWriterTestCase(DatabaseTestCase):
+    def writer(self, **env):
+        with mock.patch.dict(os.environ, env):
+            return DatabaseWriter(self.db)
+
+    def query(self, sql):
+        with self.db.get_db(readonly=True) as conn:
+            return [tuple(row) for row in conn.execute(sql)]
+
+
+class StatusHistoryTest(DatabaseWriterTestCase):
+    def test_history_is_written_with_single_mutation_batches(self):
+        writer = self.writer(DB_BATCH_SIZE='1')
+        writer.update_service_status('web', 'UP', 1, tick=1)
+        writer.update_service_status('web', 'DOWN', 2, tick=1)
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(self.query("SELECT status FROM current_status WHERE service_name = 'web' ORDER BY team_id"),
+                         [('UP',), ('DOWN',), ('UP',)])
+        self.assertEqual(self.query('SELECT tick, team_id, status FROM status_history ORDER BY team_id'),
+                         [(1, 1, 'UP'), (1, 2, 'DOWN')])
+
+    def test_status_without_tick_has_no_history(self):
+        writer = self.writer()
+        writer.update_service_status('web', 'UP', 1)
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(self.query("SELECT status FROM current_status WHERE team_id = 1"), [('UP',)])
+        self.assertEqual(self.query('SELECT * FROM status_history'), [])
+
+
+class DroppedWritesTest(DatabaseWriterTestCase):
+    def dropped(self):
+        return DB_DROPPED.collect().get((), 0)
+
+    def test_bad_row_only_drops_itself(self):
+        writer = self.writer()
+        dropped = self.dropped()
+        writer.insert_flag('web', 1, 1, 'flag{good}')
+        # SQLite can't bind the flag, so only this row fails
+        writer.insert_flag('web', 1, 2, object())
+        writer.update_service_status('web', 'DOWN', 3, tick=1)
+        writer.update_service_score('web', 'UP', 1, 1)
+        self.assertFalse(writer.flush(timeout=10))
+        self.assertIn('binding parameter', writer.last_error)
+        self.assertEqual(self.dropped() - dropped, 1)
+
+        self.assertEqual(self.query('SELECT flag FROM current_flags'), [('flag{good}',)])
+        self.assertEqual(self.query('SELECT team_id, status FROM status_history'), [(3, 'DOWN')])
+        self.assertEqual(self.query('SELECT id, sla_points FROM teams WHERE sla_points > 0'), [(1, 10)])
+        # Reported once, the next flush is clean again
+        self.assertTrue(writer.flush(timeout=10))
+
+    def test_lock_outlasting_retries_is_counted(self):
+        writer = self.writer()
+        dropped = self.dropped()
+        locked = sqlite3.OperationalError('database is locked')
+        with mock.patch.object(writer, '_execute', side_effect=locked), mock.patch('database_writer.time.sleep'):
+            writer.insert_flag('web', 1, 1, 'flag{a}')
+            writer.update_service_status('web', 'DOWN', 1, tick=1)
+            self.assertFalse(writer.flush(timeout=10))
+        self.assertIn('still locked', writer.last_error)
+        self.assertEqual(self.dropped() - dropped, 2)
+        self.assertEqual(self.query('SELECT * FROM current_flags'), [])
+
+        writer.insert_flag('web', 1, 1, 'flag{a}')
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(self.query('SELECT flag FROM current_flags'), [('flag{a}',)])
+
+    def test_flush_times_out(self):
+        writer = self.writer()
+        stuck = threading.Event()
+        self.addCleanup(stuck.set)
+        with mock.patch.object(writer, '_write_batch', side_effect=lambda batch: stuck.wait(10)):
+            writer.insert_flag('web', 1, 1, 'flag{a}')
+            self.assertFalse(writer.flush(timeout=0.2))
+        self.assertIn('timed out', writer.last_error)
+
+
+if __name__ == '__main__':
+    unittest.main()
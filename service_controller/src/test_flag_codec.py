@@ -0,0 +1,46 @@
+import unittest
+
+from flag_codec import FLAG_LENGTH, FlagCodec
+
+
+class FlagCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = FlagCodec('secret', ['web', 'api'])
+
+    def test_round_trip(self):
+        flag = self.codec.encode(7, 'web', 42)
+        self.assertEqual(len(flag), FLAG_LENGTH)
+        self.assertEqual(self.codec.decode(flag), (7, 'web', 42))
+
+    def test_flags_are_unique(self):
+        self.assertNotEqual(self.codec.encode(1, 'api', 1), self.codec.encode(1, 'api', 1))
+
+    def test_service_order_does_not_matter(self):
+        other = FlagCodec(b'secret', ['api', 'web'])
+        self.assertEqual(other.decode(self.codec.encode(3, 'api', 9)), (3, 'api', 9))
+
+    def test_forged_payload_is_rejected(self):
+        flag = self.codec.encode(1, 'web', 5)
+        raw = bytearray.fromhex(flag[5:-1])
+        # Claim the flag belongs to team 2
+        raw[1] ^= 0x03
+        self.assertIsNone(self.codec.decode("flag{" + raw.hex() + "}"))
+
+    def test_forged_mac_is_rejected(self):
+        flag = self.codec.encode(1, 'web', 5)
+        last = '0' if flag[-2] != '0' else '1'
+        self.assertIsNone(self.codec.decode(flag[:-2] + last + "}"))
+
+    def test_other_secret_is_rejected(self):
+        flag = FlagCodec('other', ['web', 'api']).encode(1, 'web', 5)
+        self.assertIsNone(self.codec.decode(flag))
+
+    def test_malformed_flags_are_rejected(self):
+        flag = self.codec.encode(1, 'web', 5)
+        for malformed in ("", "flag{}", flag[:-1], flag + "0", "flag{" + "z" * (FLAG_LENGTH - 6) + "}",
+                          "FLAG" + flag[4:]):
+            self.assertIsNone(self.codec.decode(malformed), malformed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+from flag_index import FlagIndex
+
+
+class FlagIndexTest(unittest.TestCase):
+    def test_validity_window(self):
+        index = FlagIndex(validity_ticks=2, expired_ticks=1)
+        self.assertTrue(index.is_valid(10, 10))
+        self.assertTrue(index.is_valid(9, 10))
+        self.assertFalse(index.is_valid(8, 10))
+        self.assertFalse(index.is_valid(11, 10))
+
+    def test_expire_drops_old_ticks(self):
+        index = FlagIndex(validity_ticks=1, expired_ticks=1)
+        index.add('flag{a}', 1, 'web', 1)
+        index.add('flag{b}', 1, 'web', 2)
+        index.expire(2)
+        self.assertEqual(index.lookup('flag{a}'), (1, 'web', 1))
+        index.expire(3)
+        self.assertIsNone(index.lookup('flag{a}'))
+        self.assertEqual(index.lookup('flag{b}'), (1, 'web', 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import unittest
+from unittest import mock
+
+from rate_limiter import RateLimiter, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=10, burst=5)
+        now = bucket.updated
+        self.assertEqual(bucket.take(5, now), 0)
+        # Empty, one token comes back every 0.1s
+        self.assertAlmostEqual(bucket.take(1, now), 0.1)
+        self.assertAlmostEqual(bucket.take(3, now), 0.3)
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(rate=10, burst=5)
+        now = bucket.updated
+        bucket.take(5, now)
+        self.assertAlmostEqual(bucket.take(2, now + 0.25), 0.0)
+        self.assertAlmostEqual(bucket.tokens, 0.5)
+        # An hour idle still only refills the burst
+        self.assertEqual(bucket.take(5, now + 3600), 0)
+        self.assertGreater(bucket.take(1, now + 3600), 0)
+
+    def test_failed_take_keeps_tokens(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        now = bucket.updated
+        self.assertAlmostEqual(bucket.take(3, now), 1.0)
+        self.assertEqual(bucket.take(2, now), 0)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def limiter(self, **env):
+        values = {'SUBMIT_REQUESTS_PER_SECOND': '2', 'SUBMIT_REQUEST_BURST': '2',
+                  'SUBMIT_FLAGS_PER_SECOND': '100', 'SUBMIT_FLAG_BURST': '100',
+                  'SUBMIT_MAX_FLAGS_PER_REQUEST': '50'}
+        values.update(env)
+        with mock.patch.dict(os.environ, values):
+            return RateLimiter()
+
+    def test_request_limit_refills(self):
+        limiter = self.limiter()
+        with mock.patch('rate_limiter.time.monotonic', return_value=1000.0):
+            self.assertIsNone(limiter.check(1, 1))
+            self.assertIsNone(limiter.check(1, 1))
+            reason, retry_after = limiter.check(1, 1)
+        self.assertEqual(reason, 'requests')
+        self.assertAlmostEqual(retry_after, 0.5)
+        with mock.patch('rate_limiter.time.monotonic', return_value=1000.5):
+            self.assertIsNone(limiter.check(1, 1))
+        self.assertEqual(limiter.rejections, {1: {'requests': 1}})
+
+    def test_teams_have_separate_buckets(self):
+        limiter = self.limiter()
+        with mock.patch('rate_limiter.time.monotonic', return_value=1000.0):
+            limiter.check(1, 0)
+            limiter.check(1, 0)
+            self.assertIsNotNone(limiter.check(1, 0))
+            self.assertIsNone(limiter.check(2, 0))
+
+    def test_flag_limits(self):
+        limiter = self.limiter()
+        with mock.patch('rate_limiter.time.monotonic', return_value=1000.0):
+            self.assertEqual(limiter.check(1, 51), ('too_many_flags', 0))
+            self.assertIsNone(limiter.check(1, 50, count_request=False))
+            self.assertIsNone(limiter.check(1, 50, count_request=False))
+            reason, retry_after = limiter.check(1, 10, count_request=False)
+        self.assertEqual(reason, 'flags')
+        self.assertAlmostEqual(retry_after, 0.1)
+
+    def test_zero_rate_disables_limit(self):
+        limiter = self.limiter(SUBMIT_REQUESTS_PER_SECOND='0', SUBMIT_FLAGS_PER_SECOND='0')
+        for _ in range(100):
+            self.assertIsNone(limiter.check(1, 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+from scoreboard_operations import VERDICT_ACCEPTED, VERDICT_DUPLICATE, VERDICT_INVALID, app
+from test_captures import DatabaseTestCase
+
+
+class SubmitStreamTest(DatabaseTestCase):
+    env = dict(DatabaseTestCase.env, BULK_CHUNK_SIZE='2', BULK_MAX_LINE='64')
+
+    def submit(self, scoreboard, body):
+        app.scoreboard = scoreboard
+        response = app.test_client().post('/submit_flags/stream?team_id=2', data=body)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_verdicts_keep_input_order(self):
+        scoreboard = self.scoreboard()
+        scoreboard.set_tick(3)
+        self.plant(scoreboard, 'flag{a}', 1, 3)
+        self.plant(scoreboard, 'flag{b}', 1, 3)
+        body = b'flag{a}\n\n' + b'x' * 200 + b'\n{"flag": "flag{b}"}\nflag{a}\n'
+        verdicts = self.submit(scoreboard, body)
+        self.assertEqual([(verdict['line'], verdict['flag'], verdict['verdict']) for verdict in verdicts[:-1]],
+                         [(1, 'flag{a}', VERDICT_ACCEPTED), (3, None, VERDICT_INVALID),
+                          (4, 'flag{b}', VERDICT_ACCEPTED), (5, 'flag{a}', VERDICT_DUPLICATE)])
+        self.assertEqual(verdicts[-1]['summary'], {VERDICT_ACCEPTED: 2, VERDICT_INVALID: 1, VERDICT_DUPLICATE: 1})
+
+    def test_chunks_are_capped_at_flag_burst(self):
+        with mock.patch.dict(os.environ, {'SUBMIT_FLAGS_PER_SECOND': '1', 'SUBMIT_FLAG_BURST': '1'}):
+            scoreboard = self.scoreboard()
+        scoreboard.set_tick(3)
+        self.plant(scoreboard, 'flag{a}', 1, 3)
+        verdicts = self.submit(scoreboard, b'flag{a}\nflag{b}\n')
+        # A chunk of two flags would never fit the burst of one, the first flag still gets through
+        self.assertEqual(verdicts[0]['verdict'], VERDICT_ACCEPTED)
+
+
+if __name__ == '__main__':
+    unittest.main()
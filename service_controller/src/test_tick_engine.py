@@ -0,0 +1,158 @@
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from checker_operations import UNREACHABLE, CheckerOperations
+from circuit_breaker import CircuitBreaker
+from tick_engine import TickEngine
+
+
+class TickEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.results = {}
+        self.stuck = threading.Event()
+        self.addCleanup(self.stuck.set)
+
+    def record_result(self, service_name, tick, team, status):
+        self.results[(tick, team)] = status
+
+    # Team 1 hangs in tick 1 and ignores its timeout, every other check is UP at once
+    def run_check(self, service_name, tick, team, timeout):
+        if tick == 1 and team == 1:
+            self.stuck.wait(10)
+        return "UP"
+
+    def test_overrunning_thread_keeps_its_slot(self):
+        engine = TickEngine(self.run_check, self.record_result, max_concurrency=2, service_limits={})
+        self.addCleanup(engine.shutdown)
+
+        async def ticks():
+            await engine.run_tick(['web'], 1, [1, 2], {'web': 0.2}, deadline=time.time() + 2)
+            self.assertEqual(engine.busy_workers, 1)
+            await engine.run_tick(['web'], 2, [1, 2, 3], {'web': 0.2}, deadline=time.time() + 2)
+            # Still stuck in tick 1, tick 2 ran its checks on the one slot left
+            self.assertEqual(engine.busy_workers, 1)
+
+            self.stuck.set()
+            for _ in range(100):
+                if engine.busy_workers == 0:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(engine.busy_workers, 0)
+        asyncio.run(ticks())
+
+        self.assertEqual(self.results, {(1, 1): "DOWN", (1, 2): "UP", (2, 1): "UP", (2, 2): "UP", (2, 3): "UP"})
+
+    def test_checks_without_slot_are_down_at_deadline(self):
+        engine = TickEngine(self.run_check, self.record_result, max_concurrency=1, service_limits={})
+        self.addCleanup(engine.shutdown)
+
+        async def ticks():
+            await engine.run_tick(['web'], 1, [1], {'web': 0.2}, deadline=time.time() + 2)
+            # The only worker is stuck, so tick 2 can't start a check before its deadline
+            await engine.run_tick(['web'], 2, [1, 2], {'web': 0.2}, deadline=time.time() + 1)
+            self.stuck.set()
+        asyncio.run(ticks())
+
+        self.assertEqual(self.results, {(1, 1): "DOWN", (2, 1): "DOWN", (2, 2): "DOWN"})
+
+    def test_coroutine_checks_release_slots(self):
+        async def run_check(service_name, tick, team, timeout):
+            if team == 1:
+                await asyncio.sleep(10)
+            return "UP"
+
+        engine = TickEngine(run_check, self.record_result, max_concurrency=1, service_limits={})
+        self.addCleanup(engine.shutdown)
+
+        async def ticks():
+            await engine.run_tick(['web'], 1, [1, 2], {'web': 0.2}, deadline=time.time() + 2)
+        asyncio.run(ticks())
+
+        self.assertEqual(self.results, {(1, 1): "DOWN", (1, 2): "UP"})
+        self.assertEqual(engine.busy_workers, 0)
+
+
+# Plugin that catches request errors like the bundled checkers
+CHECKER = """import requests
+
+def check(team, http, timeout=5):
+    try:
+        return 'UP' if http.get(f'http://{team}:%s/', timeout=timeout).ok else 'DOWN'
+    except requests.RequestException:
+        return 'DOWN'
+
+def plant_flag(team, flag):
+    pass
+"""
+
+
+# Port on localhost nothing listens on
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.results = {}
+        self.calls = 0
+        self.breaker = CircuitBreaker({'web': closed_port()}, {'team1': '127.0.0.1'})
+
+    def record_result(self, service_name, tick, team, status):
+        self.results[tick] = status
+
+    def run_ticks(self, status, ticks=4):
+        def run_check(service_name, tick, team, timeout):
+            self.calls += 1
+            return status
+
+        engine = TickEngine(run_check, self.record_result, max_concurrency=2, service_limits={}, breaker=self.breaker)
+        self.addCleanup(engine.shutdown)
+
+        async def run():
+            for tick in range(1, ticks + 1):
+                await engine.run_tick(['web'], tick, [1], {'web': 1}, deadline=time.time() + 2)
+        asyncio.run(run())
+
+    def test_connection_failures_trip_the_breaker(self):
+        self.run_ticks(UNREACHABLE)
+        # Ticks 3 and 4 are refused by the probe without running the checker
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(set(self.results.values()), {"DOWN"})
+        self.assertTrue(self.breaker.is_open('web', 1))
+
+    def test_other_down_results_do_not_count(self):
+        self.run_ticks("DOWN")
+        self.assertEqual(self.calls, 4)
+        self.assertFalse(self.breaker.is_open('web', 1))
+
+    def test_probe_is_capped_by_timeout(self):
+        self.breaker.failures[('web', 1)] = self.breaker.threshold
+        self.breaker.probe_timeout = 5
+        async def hang(host, port):
+            await asyncio.sleep(10)
+
+        # The connect hangs until the probe gives up
+        with mock.patch('circuit_breaker.asyncio.open_connection', hang):
+            start = time.time()
+            self.assertFalse(asyncio.run(self.breaker.allow('web', 1, 0.1)))
+        self.assertLess(time.time() - start, 1)
+
+    def test_checker_reports_connection_failures(self):
+        with tempfile.TemporaryDirectory() as checker_dir:
+            with open(os.path.join(checker_dir, 'web_checker.py'), 'w') as f:
+                f.write(CHECKER % closed_port())
+            checkers = CheckerOperations(checker_dir)
+            checkers.http.hosts['team1'] = '127.0.0.1'
+            self.assertEqual(checkers.run('web', 1, 'flag{a}', 2), UNREACHABLE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from checker_operations import UNREACHABLE
+from http_client import parse_pairs
+from metrics import CHECK_SECONDS, CHECKS, CHECKS_IN_PROGRESS
+import tracing
+
+# Seconds a check may run past its timeout before it is abandoned
+CHECK_GRACE = 0.5
+
+
+class TickEngine:
+    def __init__(self, run_check, record_result, max_concurrency=None, service_limits=None, breaker=None):
+        # Function run_check(service_name, tick, team, timeout) returning the service status.
+        # Blocking functions run on the worker pool, coroutine functions on the event loop
+        self.run_check = run_check
+        # Called as record_result(service_name, tick, team, status) once a check finished or overran
+        self.record_result = record_result
+        # Global cap on checks in flight across every service and team
+        self.max_concurrency = max_concurrency or int(os.getenv('MAX_CONCURRENT_CHECKS', 64))
+        # Optional per-service caps, e.g. SERVICE_CONCURRENCY="python_challenge=16,node_challenge=8"
+        if service_limits is None:
+            service_limits = parse_pairs(os.getenv('SERVICE_CONCURRENCY', ''), int)
+        self.service_limits = service_limits
+        # Blocking checkers run on a bounded pool instead of one thread per check
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='checker')
+        # Pool threads still running a check, including checks abandoned after overrunning
+        self.busy_workers = 0
+        # Global slots of the running tick
+        self.slots = None
+        # Optional CircuitBreaker that fails checks of unreachable services fast
+        self.breaker = breaker
+
+    # Run every (service, team) check of a tick in one event loop.
+    # Each check gets min(its service timeout, time left until deadline) and is marked DOWN if it overruns
+    async def run_tick(self, services, tick, teams, timeouts=None, deadline=None):
+        timeouts = timeouts or {}
+        # Threads still stuck in checks of an earlier tick keep their slots
+        self.slots = global_limit = asyncio.Semaphore(max(0, self.max_concurrency - self.busy_workers))
+        service_limits = {
+            service_name: asyncio.Semaphore(self.service_limits.get(service_name, self.max_concurrency))
+            for service_name in services
+        }
+
+        async def run_check(service_name, team):
+            with tracing.async_span(f'{service_name} team{team}', 'tick', f'{service_name}-{team}'):
+                status = await run_limited(service_name, team)
+            # Connection failures only matter to the breaker, they are scored DOWN
+            if status == UNREACHABLE:
+                status = "DOWN"
+            CHECKS.inc(service_name, status)
+            self.record_result(service_name, tick, team, status)
+
+        def time_left():
+            return max(0, deadline - time.time() - CHECK_GRACE) if deadline is not None else None
+
+        # Wait for a global slot, gives up at the tick deadline when overrunning checks hold every slot
+        async def acquire_slot():
+            if deadline is None:
+                await global_limit.acquire()
+                return True
+            try:
+                await asyncio.wait_for(global_limit.acquire(), time_left())
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+        async def run_limited(service_name, team):
+            # Take the service slot first so waiting checks don't hold global slots
+            async with service_limits[service_name]:
+                if not await acquire_slot():
+                    CHECKS_IN_PROGRESS.dec('queued')
+                    print(f"No checker slot for {service_name} team {team} before the tick deadline")
+                    return "DOWN"
+                CHECKS_IN_PROGRESS.dec('queued')
+                # Probing an open breaker holds the slot and stops at the tick deadline
+                if self.breaker is not None and not await self.breaker.allow(service_name, team, time_left()):
+                    # Still unreachable, DOWN without running the checker
+                    global_limit.release()
+                    self.breaker.record(service_name, team, UNREACHABLE)
+                    return UNREACHABLE
+                CHECKS_IN_PROGRESS.inc('running')
+                start = time.perf_counter()
+                timeout = timeouts.get(service_name)
+                if deadline is not None:
+                    timeout = time_left() if timeout is None else min(timeout, time_left())
+                blocking = not asyncio.iscoroutinefunction(self.run_check)
+                if blocking:
+                    # An overrunning checker keeps its worker thread busy, so its slot is only freed
+                    # once the thread returns. Otherwise the next checks would queue on the pool with
+                    # their timeouts already running
+                    self.busy_workers += 1
+                    loop = asyncio.get_running_loop()
+                    check = loop.run_in_executor(self.executor, self.run_check, service_name, tick, team, timeout)
+                    check.add_done_callback(self._worker_done)
+                    check = asyncio.shield(check)
+                else:
+                    check = self.run_check(service_name, tick, team, timeout)
+                try:
+                    # Small grace so checkers can honour the timeout themselves first
+                    status = await asyncio.wait_for(check, timeout + CHECK_GRACE if timeout is not None else None)
+                    # Overruns and missing slots say nothing about whether the service accepts connections
+                    if self.breaker is not None:
+                        self.breaker.record(service_name, team, status)
+                except asyncio.TimeoutError:
+                    print(f"Check of {service_name} for team {team} overran {timeout:.1f}s")
+                    status = "DOWN"
+                finally:
+                    CHECKS_IN_PROGRESS.dec('running')
+                    if not blocking:
+                        global_limit.release()
+                CHECK_SECONDS.observe(time.perf_counter() - start, service_name, str(team))
+            return status
+
+        checks = [run_check(service_name, team) for service_name in services for team in teams]
+        CHECKS_IN_PROGRESS.inc('queued', amount=len(checks))
+        results = await asyncio.gather(*checks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Check failed in tick {tick}: {result}")
+
+    # A pool thread returned, its slot goes to whichever tick is running now
+    def _worker_done(self, future):
+        self.busy_workers -= 1
+        self.slots.release()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
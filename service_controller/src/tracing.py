@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+
+
+# Chrome trace-event recorder, one file per tick that opens in chrome://tracing or ui.perfetto.dev.
+# Disabled unless TRACE_DIR is set, spans are then a shared no-op object
+class Tracer:
+    def __init__(self):
+        self.trace_dir = os.getenv('TRACE_DIR')
+        self.enabled = bool(self.trace_dir)
+        # Share of ticks traced, the same ticks are picked in every process
+        self.sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', 1))
+        # Events kept per tick, later ones are counted as dropped
+        self.max_events = int(os.getenv('TRACE_MAX_EVENTS', 100000))
+        self.suffix = ''
+        self.pid = os.getpid()
+        self.active = False
+        self.tick = None
+        self.events = []
+        self.dropped = 0
+        self.threads = {}  # {thread id: thread name} of the tick being recorded
+        self.lock = threading.Lock()
+
+    # Processes other than the controller add a suffix so their files don't collide
+    def configure(self, suffix):
+        self.suffix = suffix
+        self.pid = os.getpid()
+
+    def sampled(self, tick):
+        return (tick * 2654435761) % 1000 < self.sample_rate * 1000
+
+    # Start recording a tick, the previous tick's events are written in the background
+    def begin_tick(self, tick):
+        if not self.enabled or tick == self.tick:
+            return
+        with self.lock:
+            previous, events, dropped, threads = self.tick, self.events, self.dropped, self.threads
+            self.tick, self.events, self.dropped, self.threads = tick, [], 0, {}
+            self.active = self.sampled(tick)
+        if previous is not None and events:
+            threading.Thread(target=self.write, args=(previous, events, dropped, threads), daemon=True).start()
+
+    # Write out the tick being recorded, e.g. on shutdown
+    def flush(self):
+        with self.lock:
+            tick, events, dropped, threads = self.tick, self.events, self.dropped, self.threads
+            self.events, self.dropped, self.threads, self.active = [], 0, {}, False
+        if tick is not None and events:
+            self.write(tick, events, dropped, threads)
+
+    def record(self, event):
+        if len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        event['pid'] = self.pid
+        event['tid'] = tid
+        self.events.append(event)
+
+    # Complete event for something that started at `start` (seconds since the epoch) and just ended
+    def complete(self, name, category, start, args=None):
+        self.record({'name': name, 'cat': category, 'ph': 'X', 'ts': start * 1e6,
+                     'dur': (time.time() - start) * 1e6, 'args': args or {}})
+
+    def write(self, tick, events, dropped, threads):
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': f'controller{self.suffix}'}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                     for tid, name in threads.items()]
+        path = os.path.join(self.trace_dir, f'tick_{tick}{self.suffix}.json')
+        try:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms',
+                           'otherData': {'tick': tick, 'dropped_events': dropped}}, f)
+        except OSError as e:
+            print(f"Unable to write trace {path}: {e}")
+
+
+class Span:
+    __slots__ = ('name', 'category', 'args', 'start')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        tracer.complete(self.name, self.category, self.start, self.args)
+
+
+# Overlapping work on one thread, like the tick engine's coroutines, is drawn as async slices
+class AsyncSpan(Span):
+    __slots__ = ('id',)
+
+    def __init__(self, name, category, args, id):
+        super().__init__(name, category, args)
+        self.id = id
+
+    def __enter__(self):
+        tracer.record({'name': self.name, 'cat': self.category, 'ph': 'b', 'id': self.id,
+                       'ts': time.time() * 1e6, 'args': self.args})
+        return self
+
+    def __exit__(self, *exc):
+        tracer.record({'name': self.name, 'cat': self.category, 'ph': 'e', 'id': self.id, 'ts': time.time() * 1e6})
+
+
+class NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP = NoopSpan()
+tracer = Tracer()
+
+
+def span(name, category, **args):
+    if not tracer.active:
+        return NOOP
+    return Span(name, category, args)
+
+
+def async_span(name, category, id, **args):
+    if not tracer.active:
+        return NOOP
+    return AsyncSpan(name, category, args, id)
@@ -0,0 +1,13 @@
+# Entry point for API_MODE=standalone, e.g.
+#   gunicorn -w 4 -k gthread --threads 64 -b 0.0.0.0:9090 wsgi:app
+from database_operations import DatabaseOperations
+from scoreboard_operations import ScoreboardOperations, app
+import os
+import tracing
+
+# Each worker writes its own trace files next to the controller's
+tracing.tracer.configure(f'.api{os.getpid()}')
+
+scoreboard = ScoreboardOperations(DatabaseOperations(), serve=False)
+scoreboard.start_state_sync()
+app.scoreboard = scoreboard
@@ -1,16 +1,22 @@
 #!/usr/bin/env python
+import ipaddress
+import itertools
 import subprocess
 import time
 import sqlite3
 import random
+import secrets
 import string
 import os
 import psutil
+import re
 import sys
 
 passwords = []
 CPU_RESERVE = 1
 MEM_RESERVE = 2048
+# Smallest network that still fits the gateway, vpn and team container
+MIN_SUBNET_PREFIX = 29
 
 def initialize_database(teams: list, services: list):
     try:
@@ -66,6 +72,64 @@ def initialize_database(teams: list, services: list):
                   FOREIGN KEY (team_id) REFERENCES teams(id),
                   FOREIGN KEY (service_name) REFERENCES services(name))''')
 
+    c.execute('''CREATE INDEX IF NOT EXISTS current_flags_round ON current_flags (round_id, team_id)''')
+
+    # Flags of rounds past the retention window, moved here by the flag archiver
+    c.execute('''CREATE TABLE IF NOT EXISTS flags_archive
+                (flag TEXT PRIMARY KEY,
+                  round_id INTEGER NOT NULL,
+                  team_id INTEGER NOT NULL,
+                  service_name TEXT NOT NULL,
+                  timestamp DATETIME NOT NULL)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS flags_archive_round ON flags_archive (round_id, team_id)''')
+
+    # Key/value state shared between the controller and standalone API workers
+    c.execute('''CREATE TABLE IF NOT EXISTS game_state
+                (key TEXT PRIMARY KEY,
+                  value NOT NULL)''')
+
+    # Accepted flag submissions, one per flag and attacking team
+    c.execute('''CREATE TABLE IF NOT EXISTS captures
+                (flag TEXT NOT NULL,
+                  team_id INTEGER NOT NULL,
+                  flag_tick INTEGER NOT NULL,
+                  tick INTEGER NOT NULL,
+                  PRIMARY KEY (flag, team_id),
+                  FOREIGN KEY (team_id) REFERENCES teams(id))''')
+    c.execute('''CREATE INDEX IF NOT EXISTS captures_flag_tick ON captures (flag_tick)''')
+
+    # Per-tick score components of every team, appended when a round is scored
+    c.execute('''CREATE TABLE IF NOT EXISTS score_history
+                (tick INTEGER NOT NULL,
+                  team_id INTEGER NOT NULL,
+                  sla_points INTEGER NOT NULL,
+                  attack_points INTEGER NOT NULL,
+                  delta INTEGER NOT NULL,
+                  score INTEGER NOT NULL,
+                  PRIMARY KEY (tick, team_id),
+                  FOREIGN KEY (team_id) REFERENCES teams(id)) WITHOUT ROWID''')
+
+    # Per-tick service status of every team
+    c.execute('''CREATE TABLE IF NOT EXISTS status_history
+                (tick INTEGER NOT NULL,
+                  team_id INTEGER NOT NULL,
+                  service_name TEXT NOT NULL,
+                  status TEXT NOT NULL,
+                  PRIMARY KEY (tick, team_id, service_name),
+                  FOREIGN KEY (team_id) REFERENCES teams(id),
+                  FOREIGN KEY (service_name) REFERENCES services(name)) WITHOUT ROWID''')
+
+    # Append-only log of SLA results and captures, tick is set when the round is scored
+    c.execute('''CREATE TABLE IF NOT EXISTS score_events
+                (id INTEGER PRIMARY KEY,
+                  tick INTEGER,
+                  kind TEXT NOT NULL,
+                  team_id INTEGER NOT NULL,
+                  service_name TEXT,
+                  points INTEGER NOT NULL,
+                  FOREIGN KEY (team_id) REFERENCES teams(id))''')
+    c.execute('''CREATE INDEX IF NOT EXISTS score_events_tick ON score_events (tick, team_id)''')
+
     for team in teams:
         c.execute('''INSERT INTO teams (name) VALUES ('%s')''' % team)
 
@@ -132,6 +196,11 @@ def generate_controller_service(team_count: int, tick_interval: int):
     environment:
       TICK_INTERVAL: %s
       NUM_TEAMS: %s
+      API_MODE: embedded
+      API_WORKERS: 4
+      EXECUTION_MODE: local
+      LOCAL_AGENTS: 4
+      AGENT_TOKEN: %s
     networks:
       - admin_network
     volumes:
@@ -139,7 +208,7 @@ def generate_controller_service(team_count: int, tick_interval: int):
       - ./vpn/config/peer1/peer1.conf:/etc/wireguard/admin.conf
     ports:
       - "8080:9090"
-    restart: unless-stopped\n\n""" % (tick_interval, team_count)
+    restart: unless-stopped\n\n""" % (tick_interval, team_count, secrets.token_hex(16))
 
 
 def generate_team_services(team_count: int, cpu: float, memory: int):
@@ -163,17 +232,24 @@ def generate_team_services(team_count: int, cpu: float, memory: int):
             memory: %sM\n\n""" % (i, i, i, i, passwords[-1], cpu, memory)
 
 
+# Split team_subnet into one network for admin and each team, skipping the first one.
+# Networks are /24 while they fit and shrink as needed so any team count fits the given range
+def allocate_subnets(count: int, team_subnet: str):
+    network = ipaddress.ip_network(team_subnet, strict=False)
+    prefix = max(24, network.prefixlen)
+    while 2 ** (prefix - network.prefixlen) < count + 1:
+        prefix += 1
+    if prefix > MIN_SUBNET_PREFIX:
+        raise ValueError("Team subnet %s is too small for %s networks" % (team_subnet, count))
+    subnets = network.subnets(new_prefix=prefix)
+    return [str(subnet) for subnet in itertools.islice(subnets, 1, count + 1)]
+
+
 def generate_networks(team_count: int, team_subnet: str):
-    
-    team_subnet = team_subnet[:-3] + "/24"
-    team_subnet = team_subnet.split(".")
 
     teams = ["admin"] + ["team%s" % _ for _ in range(1, team_count+1)]
 
-    for i in teams:
-
-        team_subnet[2] = str(int(team_subnet[2])+1)
-        team_specific_subnet = ".".join([str(_) for _ in team_subnet])
+    for i, team_specific_subnet in zip(teams, allocate_subnets(len(teams), team_subnet)):
 
         yield """  %s_network:
     driver: bridge
@@ -205,38 +281,40 @@ def generate_services(team_count: int, vpn_subnet: str, team_subnet: str, tick_i
     composef.close()
 
 
-def generate_shell_script(team_count: int, team_subnet: str):
+def shell_script(subnets: list):
 
-    shellf = open("run.sh", "w")
-    shellf.write("#!/usr/bin/env bash")
+    # Set members are loaded with a single ipset restore, rule count stays constant
+    members = "\n".join(
+        ["add ctf_subnets %s" % subnet for subnet in subnets] +
+        ["add ctf_same_subnet %s,%s" % (subnet, subnet) for subnet in subnets]
+    )
 
-    team_subnet = team_subnet[:-3] + "/24"
-    team_subnet = team_subnet.split(".")
-    team_subnet[2] = "$i"
-    team_subnet = ".".join(team_subnet)
+    return """#!/usr/bin/env bash
+cd "$(dirname "$0")"
 
-    script = """
 create_rules() {
     # Flush existing rules in DOCKER-USER chain
     iptables -F DOCKER-USER
 
+    # Admin and team networks, and the (network, same network) pairs allowed to talk
+    ipset create ctf_subnets hash:net -exist
+    ipset create ctf_same_subnet hash:net,net -exist
+    ipset flush ctf_subnets
+    ipset flush ctf_same_subnet
+    ipset restore -exist <<EOF
+%s
+EOF
+
     # Allow traffic within each subnet and isolate between subnets
-    for i in $(seq 1 %s); do
-        iptables -A DOCKER-USER -s %s -d %s -j ACCEPT
-    done
-
-    for i in $(seq 1 %s); do
-        for j in $(seq 1 %s); do
-            if [ $i -ne $j ]; then
-                iptables -A DOCKER-USER -s %s -d %s -j DROP
-            fi
-        done
-    done
+    iptables -A DOCKER-USER -m set --match-set ctf_same_subnet src,dst -j ACCEPT
+    iptables -A DOCKER-USER -m set --match-set ctf_subnets src -m set --match-set ctf_subnets dst -j DROP
 }
 
 delete_rules() {
     # Flush all rules in the DOCKER-USER chain
     iptables -F DOCKER-USER
+    ipset destroy ctf_same_subnet 2>/dev/null
+    ipset destroy ctf_subnets 2>/dev/null
 }
 
 # Check if running as root
@@ -256,19 +334,273 @@ else
     echo "Usage: $0 -u (to up) or -d (to down)"
     exit 1
 fi
-""" % (
-    team_count+1, 
-    team_subnet, team_subnet,
-    team_count+1, team_count+1,
-    team_subnet, team_subnet.replace("$i", "$j")
-    )
+""" % members
+
 
-    shellf.write(script)
+def generate_shell_script(team_count: int, team_subnet: str):
+
+    shellf = open("run.sh", "w")
+    shellf.write(shell_script(allocate_subnets(team_count+1, team_subnet)))
     shellf.close()
 
 
+# Assign teams to hosts by the team containers each host fits after the reserve. Each team goes
+# to the host with the largest free fraction, ties to the first listed, so the plan only
+# depends on the configuration
+def plan_shards(team_count: int, hosts: list, team_cpus: float, team_memory: int):
+    slots = [
+        max(0, min(int((host["cpus"] - CPU_RESERVE) // team_cpus),
+                   int((host["memory"] - MEM_RESERVE) // team_memory)))
+        for host in hosts
+    ]
+    if sum(slots) < team_count:
+        raise ValueError("Hosts fit %s team containers of %s CPUs and %sM, %s teams need placing"
+                         % (sum(slots), team_cpus, team_memory, team_count))
+
+    shards = [[] for _ in hosts]
+    for team in range(1, team_count+1):
+        free = [(slots[i] - len(shards[i])) / slots[i] if slots[i] else 0 for i in range(len(hosts))]
+        shards[free.index(max(free))].append(team)
+    return shards
+
+
+# Split vpn_subnet into one network per shard, each shard's vpn hands out addresses from its own slice.
+# Networks are /24 while the peers fit and grow as needed, the server and every peer need an address
+def allocate_vpn_subnets(count: int, vpn_subnet: str, peer_count: int):
+    network = ipaddress.ip_network(vpn_subnet, strict=False)
+    prefix = 24
+    while prefix > 0 and vpn_peer_capacity(prefix) < peer_count:
+        prefix -= 1
+    if network.prefixlen > prefix or 2 ** (prefix - network.prefixlen) < count:
+        raise ValueError("VPN subnet %s is too small for %s /%s networks" % (vpn_subnet, count, prefix))
+    return [str(subnet) for subnet in itertools.islice(network.subnets(new_prefix=prefix), count)]
+
+
+# Peers a vpn network of this prefix can address, besides its network, broadcast and server addresses
+def vpn_peer_capacity(prefix: int):
+    return 2 ** (32 - prefix) - 3
+
+
+# Static address of a team container, the top of its network so it never races the dynamic
+# addresses docker hands to the gateway and vpn
+def team_address(subnet: str):
+    return str(ipaddress.ip_network(subnet)[-2])
+
+
+# Offline checks of a shard plan, nothing here talks to the hosts
+def validate_shards(hosts: list, shards: list, team_count: int, subnets: list, vpn_subnets: list,
+                    team_subnet: str, team_cpus: float, team_memory: int):
+    names = [host["name"] for host in hosts]
+    for name in names:
+        if not re.fullmatch(r"[A-Za-z0-9_.-]+", name):
+            raise ValueError("Host name %r can't be used as a directory name" % name)
+    if len(set(names)) != len(names):
+        raise ValueError("Host names must be unique")
+
+    for host, teams in zip(hosts, shards):
+        if not host.get("address"):
+            raise ValueError("Host %s has no address for its vpn endpoint" % host["name"])
+        if len(teams) * team_cpus > host["cpus"] - CPU_RESERVE or len(teams) * team_memory > host["memory"] - MEM_RESERVE:
+            raise ValueError("Host %s can't fit its %s teams" % (host["name"], len(teams)))
+
+    # Peer 1 is the controller, every team gets a peer on every shard
+    for vpn in vpn_subnets:
+        capacity = vpn_peer_capacity(ipaddress.ip_network(vpn).prefixlen)
+        if team_count + 1 > capacity:
+            raise ValueError("VPN network %s fits %s peers, %s teams need %s" % (vpn, capacity, team_count, team_count + 1))
+
+    placed = sorted(team for teams in shards for team in teams)
+    if placed != list(range(1, team_count+1)):
+        raise ValueError("Every team must be placed on exactly one host")
+
+    networks = [ipaddress.ip_network(subnet) for subnet in subnets + vpn_subnets]
+    for a, b in itertools.combinations(networks, 2):
+        if a.overlaps(b):
+            raise ValueError("Networks %s and %s overlap" % (a, b))
+    for vpn in vpn_subnets:
+        if ipaddress.ip_network(vpn).overlaps(ipaddress.ip_network(team_subnet, strict=False)):
+            raise ValueError("VPN network %s overlaps team subnet %s" % (vpn, team_subnet))
+
+
+# Keep the passwords of an earlier run so regenerating a shard doesn't lock teams out
+def read_env(path: str):
+    env = {}
+    if os.path.exists(path):
+        for line in open(path):
+            if "=" in line:
+                key, value = line.strip().split("=", 1)
+                env[key] = value
+    return env
+
+
+def generate_shard_vpn_service(peer_count: int, server_url: str, vpn_subnet: str, subnets: list, networks: list):
+    return """  vpn:
+    image: lscr.io/linuxserver/wireguard:latest
+    container_name: vpn
+    cap_add:
+      - NET_ADMIN
+      - SYS_MODULE
+    environment:
+      - PUID=1000
+      - PGID=1000
+      - TZ=Etc/IST
+      - SERVERURL=%s
+      - SERVERPORT=51820
+      - PEERS=%s
+      - PEERDNS=auto
+      - INTERNAL_SUBNET=%s
+      - ALLOWEDIPS=%s
+      - LOG_CONFS=true
+    volumes:
+      - ./vpn/config:/config
+      - /lib/modules:/lib/modules
+    ports:
+      - 51820:51820/udp
+    sysctls:
+      - net.ipv4.conf.all.src_valid_mark=1
+    networks:
+%s
+    restart: unless-stopped\n\n""" % (
+      server_url,
+      peer_count,
+      vpn_subnet,
+      ",".join([vpn_subnet] + subnets),
+      "\n".join(["      - %s_network" % network for network in networks])
+    )
+
+
+def generate_shard_controller_service(team_count: int, tick_interval: int, checker_hosts: str):
+    return """  service_controller:
+    build:
+      context: ../..
+      dockerfile: service_controller/Dockerfile
+    container_name: service_controller
+    depends_on:
+      - vpn
+    cap_add:
+      - NET_ADMIN
+      - SYS_MODULE
+    sysctls:
+      - net.ipv4.conf.all.src_valid_mark=1
+    environment:
+      TICK_INTERVAL: %s
+      NUM_TEAMS: %s
+      CHECKER_HOSTS: %s
+      API_MODE: embedded
+      API_WORKERS: 4
+      EXECUTION_MODE: local
+      LOCAL_AGENTS: 4
+      AGENT_TOKEN: ${AGENT_TOKEN}
+    networks:
+      - admin_network
+    volumes:
+      - ../../database:/app/database
+      - ./wireguard:/etc/wireguard
+    ports:
+      - "8080:9090"
+    restart: unless-stopped\n\n""" % (tick_interval, team_count, checker_hosts)
+
+
+def generate_shard_team_services(teams: list, cpu: float, memory: int, subnets: dict):
+    for i in teams:
+        yield """  team%s:
+    build:
+      context: ../../teams
+      dockerfile: Dockerfile
+    container_name: team%s
+    networks:
+      team%s_network:
+        ipv4_address: %s
+    environment:
+      TEAM_ID: %s
+      ROOT_PASSWORD: ${TEAM%s_PASSWORD}
+    restart: unless-stopped
+    deploy:
+      resources:
+          limits:
+            cpus: '%s'
+            memory: %sM\n\n""" % (i, i, i, team_address(subnets["team%s" % i]), i, i, cpu, memory)
+
+
+# One directory per host under shards/ with its docker-compose.yml, run.sh and .env.
+# The first host runs the controller, it reaches the other shards as peer 1 of their vpn
+def generate_shards(hosts: list, team_count: int, vpn_subnet: str, team_subnet: str, tick_interval: int,
+                    team_cpus: float, team_memory: int):
+
+    shards = plan_shards(team_count, hosts, team_cpus, team_memory)
+    names = ["admin"] + ["team%s" % _ for _ in range(1, team_count+1)]
+    subnet_list = allocate_subnets(len(names), team_subnet)
+    subnets = dict(zip(names, subnet_list))
+    vpn_subnets = allocate_vpn_subnets(len(hosts), vpn_subnet, team_count + 1)
+    validate_shards(hosts, shards, team_count, subnet_list, vpn_subnets, team_subnet, team_cpus, team_memory)
+
+    checker_hosts = ",".join("team%s=%s" % (i, team_address(subnets["team%s" % i])) for i in range(1, team_count+1))
+
+    for index, (host, teams) in enumerate(zip(hosts, shards)):
+        path = os.path.join("shards", host["name"])
+        os.makedirs(path, exist_ok=True)
+        primary = index == 0
+        networks = (["admin"] if primary else []) + ["team%s" % i for i in teams]
+
+        composef = open(os.path.join(path, "docker-compose.yml"), "w")
+        composef.write("version: '3'\n\n")
+        composef.write("services:\n")
+        composef.write(generate_shard_vpn_service(team_count+1, host["address"], vpn_subnets[index],
+                                                  [subnets[network] for network in networks], networks))
+        if primary:
+            composef.write(generate_shard_controller_service(team_count, tick_interval, checker_hosts))
+        for service in generate_shard_team_services(teams, team_cpus, team_memory, subnets):
+            composef.write(service)
+        composef.write("networks:\n")
+        for network in networks:
+            composef.write("""  %s_network:
+    driver: bridge
+    ipam:
+      config:
+        - subnet: %s\n""" % (network, subnets[network]))
+        composef.close()
+
+        shellf = open(os.path.join(path, "run.sh"), "w")
+        shellf.write(shell_script([subnets[network] for network in networks]))
+        shellf.close()
+        os.chmod(os.path.join(path, "run.sh"), 0o755)
+
+        env = read_env(os.path.join(path, ".env"))
+        envf = open(os.path.join(path, ".env"), "w")
+        for i in teams:
+            key = "TEAM%s_PASSWORD" % i
+            if key not in env:
+                env[key] = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
+            envf.write("%s=%s\n" % (key, env[key]))
+        if primary:
+            # Checker agent jobs carry every flag, the controller's job server always needs a token
+            env.setdefault("AGENT_TOKEN", secrets.token_hex(16))
+            envf.write("AGENT_TOKEN=%s\n" % env["AGENT_TOKEN"])
+        envf.close()
+
+        # Same layout as the single host setup, peer N+1 belongs to team N. The vpn container
+        # adds its keys and configs next to the password when it first starts
+        for i in teams:
+            peer = os.path.join(path, "vpn", "config", "peer%s" % (i+1))
+            os.makedirs(peer, exist_ok=True)
+            passwordf = open(os.path.join(peer, "password.txt"), "w")
+            passwordf.write("%s\n" % env["TEAM%s_PASSWORD" % i])
+            passwordf.close()
+
+        if primary:
+            os.makedirs(os.path.join(path, "wireguard"), exist_ok=True)
+
+    return shards
+
+
 def main(services: list, teams: list, vpn_subnet: str, team_subnet: str, tick_interval: int):
 
+    try:
+        allocate_subnets(len(teams)+1, team_subnet)
+    except ValueError as e:
+        print("[-] %s" % e)
+        exit(1)
+
     initialize_database(teams, services)
     print("[+] Initialized the database")
 
@@ -299,6 +631,40 @@ def main(services: list, teams: list, vpn_subnet: str, team_subnet: str, tick_in
     print("[+] Generated password text files")
 
 
+def main_sharded(services: list, teams: list, vpn_subnet: str, team_subnet: str, tick_interval: int,
+                 hosts: list, team_cpus: float, team_memory: int, check: bool):
+
+    try:
+        shards = plan_shards(len(teams), hosts, team_cpus, team_memory)
+        subnets = allocate_subnets(len(teams)+1, team_subnet)
+        vpn_subnets = allocate_vpn_subnets(len(hosts), vpn_subnet, len(teams) + 1)
+        validate_shards(hosts, shards, len(teams), subnets, vpn_subnets, team_subnet, team_cpus, team_memory)
+    except (KeyError, ValueError) as e:
+        print("[-] Invalid shard configuration: %s" % e)
+        exit(1)
+
+    for host, shard, vpn in zip(hosts, shards, vpn_subnets):
+        print("[+] %s (%s): vpn %s, teams %s" % (host["name"], host["address"], vpn, ", ".join(map(str, shard)) or "none"))
+
+    if check:
+        return
+
+    initialize_database(teams, services)
+    print("[+] Initialized the database")
+
+    generate_shards(hosts, len(teams), vpn_subnet, team_subnet, tick_interval, team_cpus, team_memory)
+    print("[+] Generated shards/<host>/docker-compose.yml, run.sh and .env")
+    print("[+] Generated password text files in shards/<host>/vpn/config/peer<team+1>/ of each team's host")
+
+    primary = hosts[0]["name"]
+    print("\nOn every host, from a copy of this directory:")
+    print("    sudo bash shards/<host>/run.sh -u")
+    print("Then copy each host's shards/<host>/vpn/config/peer1/peer1.conf to")
+    print("shards/%s/wireguard/wg<n>.conf on %s and restart service_controller" % (primary, primary))
+    print("Hand team N the peer<N+1> config of every host's shards/<host>/vpn/config, and the")
+    print("password.txt found in that directory on the host running its container")
+
+
 if __name__ == "__main__":
 
     if len(sys.argv) == 1:
@@ -323,16 +689,22 @@ if __name__ == "__main__":
 
       main(services, teams, vpn_subnet, team_subnet, tick_interval)
 
-    elif len(sys.argv) == 2:
+    elif len(sys.argv) == 2 or (len(sys.argv) == 3 and sys.argv[2] == "--check"):
       import json
 
       config_file = open(sys.argv[1], "r")
       config = json.load(config_file)
 
-      main(config["services"], config["teams"], config["vpn_subnet"], config["team_subnet"], config["tick_interval"])
+      if "hosts" in config:
+        main_sharded(config["services"], config["teams"], config["vpn_subnet"], config["team_subnet"], config["tick_interval"],
+                     config["hosts"], config.get("team_cpus", 1), config.get("team_memory", 1024), len(sys.argv) == 3)
+      elif len(sys.argv) == 3:
+        print("[-] --check needs a configuration with hosts")
+      else:
+        main(config["services"], config["teams"], config["vpn_subnet"], config["team_subnet"], config["tick_interval"])
 
     else:
-      print(f"[-] Usage: python {sys.argv[0]} Optional[Configuration file path]")
+      print(f"[-] Usage: python {sys.argv[0]} Optional[Configuration file path [--check]]")
 
 
     